@@ -0,0 +1,125 @@
+import asyncio
+import math
+import re
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from config import ADMISSION_LIMITS
+import metrics
+
+READ = "read"
+WRITE = "write"
+EXPENSIVE = "expensive"
+
+# Requests that scan or hash large parts of the ledger, whatever their method
+EXPENSIVE_ROUTES = (
+    ("POST", re.compile(r"/v1/transactions/seal")),
+    ("GET", re.compile(r"/v1/manifests/[^/]+/verify")),
+    ("GET", re.compile(r"/v1/reports/reconciliation")),
+    ("GET", re.compile(r"/v1/exports/.*")),
+)
+READ_METHODS = ("GET", "HEAD")
+
+# Why a request was turned away, with the status it gets: a full queue means this client should slow down,
+# a missed queue deadline means the server is behind
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT = "queue_timeout"
+REJECTION_STATUS = {QUEUE_FULL: 429, QUEUE_TIMEOUT: 503}
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    # Only the API is limited, so docs and /metrics stay reachable under overload
+    if not path.startswith("/v1/"):
+        return None
+    for expensive_method, pattern in EXPENSIVE_ROUTES:
+        if method == expensive_method and pattern.fullmatch(path):
+            return EXPENSIVE
+    return READ if method in READ_METHODS else WRITE
+
+
+class Limiter:
+    # At most `concurrency` requests run; up to `queue_size` more wait in arrival order, each for at most
+    # `queue_timeout` seconds. Futures are created per wait rather than held in an asyncio.Semaphore, so a
+    # limiter is not tied to the event loop it was first used on.
+    def __init__(self, concurrency: int, queue_size: int, queue_timeout: float):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    async def acquire(self) -> Optional[str]:
+        # None once a slot is held, otherwise why the request was rejected
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.queue_size:
+            return QUEUE_FULL
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            return QUEUE_TIMEOUT
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return None
+
+    def release(self):
+        # Hand the slot straight to the next live waiter, so a newcomer cannot overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+def create_limiters(limits: Dict[str, Tuple[int, int, float]] = ADMISSION_LIMITS) -> Dict[str, Limiter]:
+    return {name: Limiter(*limit) for name, limit in limits.items()}
+
+
+class AdmissionMiddleware:
+    # Plain ASGI middleware, so a slot is held until the last byte of a streamed response has been sent
+    def __init__(self, app, limiters: Optional[Dict[str, Limiter]] = None):
+        self.app = app
+        self.limiters = limiters if limiters is not None else create_limiters()
+
+    async def __call__(self, scope, receive, send):
+        limiter_name = route_class(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        limiter = self.limiters.get(limiter_name)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        started = asyncio.get_running_loop().time()
+        rejection = await limiter.acquire()
+        metrics.ADMISSION_QUEUE_SECONDS.observe(asyncio.get_running_loop().time() - started, route_class=limiter_name)
+        if rejection:
+            metrics.ADMISSION_REJECTED.inc(route_class=limiter_name, reason=rejection)
+            response = JSONResponse(
+                {"detail": f"Too many {limiter_name} requests in flight; retry later."},
+                status_code=REJECTION_STATUS[rejection], headers={"Retry-After": str(limiter.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        metrics.ADMISSION_ACTIVE.inc(route_class=limiter_name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metrics.ADMISSION_ACTIVE.dec(route_class=limiter_name)
+            limiter.release()
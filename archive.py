@@ -0,0 +1,123 @@
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import and_, func, insert, union_all
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, delete, select
+
+from models import Transaction, ArchivedTransaction, Revision, SealedManifest
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 10000
+DEFAULT_RETENTION_DAYS = 90
+COLUMNS = tuple(column.name for column in Transaction.__table__.columns)
+
+# Hot and archived rows as one Transaction-shaped source. SQLite pushes WHERE clauses into both sides of the
+# UNION ALL, so each side still starts from its own indexes.
+LEDGER = aliased(
+    Transaction,
+    union_all(select(*Transaction.__table__.columns), select(*ArchivedTransaction.__table__.columns)).subquery(),
+    name="ledger",
+)
+
+
+def reaches_archive(session: Session, first_id: Optional[int] = None, last_id: Optional[int] = None,
+                    start: Optional[datetime] = None, end: Optional[datetime] = None) -> bool:
+    # Whether any archived row falls in the id range [first_id, last_id] and the time window [start, end);
+    # one indexed probe, so reads that stay in the hot period never touch the archive
+    filters = []
+    if first_id is not None:
+        filters.append(ArchivedTransaction.id >= first_id)
+    if last_id is not None:
+        filters.append(ArchivedTransaction.id <= last_id)
+    if start is not None:
+        filters.append(ArchivedTransaction.timestamp >= start)
+    if end is not None:
+        filters.append(ArchivedTransaction.timestamp < end)
+    return session.exec(select(ArchivedTransaction.id).where(*filters).limit(1)).first() is not None
+
+
+def transaction_source(session: Session, first_id: Optional[int] = None, last_id: Optional[int] = None,
+                       start: Optional[datetime] = None, end: Optional[datetime] = None):
+    # Transaction, or LEDGER when the range reaches archived rows; both have the same attributes
+    return LEDGER if reaches_archive(session, first_id, last_id, start, end) else Transaction
+
+
+def archived_transaction(transaction_id: int, session: Session) -> Optional[Transaction]:
+    # Read-only copy of an archived row; it is not added to the session
+    archived = session.get(ArchivedTransaction, transaction_id)
+    return Transaction(**archived.model_dump()) if archived else None
+
+
+def restore_transaction(transaction_id: int, session: Session) -> Optional[Transaction]:
+    # Moves an archived row back to the hot table, where the foreign keys of a new revision can reach it
+    restored = session.execute(
+        insert(Transaction).from_select(
+            COLUMNS, select(*ArchivedTransaction.__table__.columns).where(ArchivedTransaction.id == transaction_id)
+        )
+    )
+    if not restored.rowcount:
+        return None
+    session.exec(delete(ArchivedTransaction).where(ArchivedTransaction.id == transaction_id))
+    return session.get(Transaction, transaction_id)
+
+
+def archive_transactions(session: Session, before: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    # Moves sealed transactions older than `before` to the archive, one committed batch at a time
+    sealed_id = session.exec(select(func.max(SealedManifest.last_transaction_id))).one()
+    newest_id = session.exec(select(func.max(Transaction.id))).one()
+    if sealed_id is None or newest_id is None:
+        return 0
+    # The newest row stays hot: SQLite numbers new rows from the hot table's max(id), so archiving it would
+    # hand its id out again
+    upper_id = min(sealed_id, newest_id - 1)
+
+    # Rows in a revision chain stay hot too, as Revision references them by foreign key
+    revised = select(Revision.original_transaction_id).union(select(Revision.corrected_transaction_id))
+    movable = and_(Transaction.timestamp < before, Transaction.id <= upper_id, Transaction.id.not_in(revised))
+
+    moved = last_id = 0
+    while True:
+        batch = session.exec(
+            select(Transaction.id).where(movable, Transaction.id > last_id).order_by(Transaction.id).limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        in_batch = and_(movable, Transaction.id.between(batch[0], batch[-1]))
+        session.execute(
+            insert(ArchivedTransaction).from_select(COLUMNS, select(*Transaction.__table__.columns).where(in_batch))
+        )
+        session.exec(delete(Transaction).where(in_batch))
+        session.commit()
+        moved += len(batch)
+        last_id = batch[-1]
+        logger.info(f"Archived {moved} transactions.")
+    return moved
+
+
+def main():
+    from config import engine
+    from dependencies import create_schema
+    from rollups import as_utc
+
+    parser = argparse.ArgumentParser(description="Move sealed transactions out of the hot transaction table.")
+    parser.add_argument("--before", type=datetime.fromisoformat,
+                        help="Archive transactions older than this timestamp (ISO 8601, UTC).")
+    parser.add_argument("--retention-days", type=int, default=DEFAULT_RETENTION_DAYS,
+                        help="Without --before, keep this many days of transactions hot.")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="Rows moved per transaction.")
+    args = parser.parse_args()
+
+    before = as_utc(args.before) if args.before else datetime.now(timezone.utc) - timedelta(days=args.retention_days)
+    create_schema()
+    with Session(engine) as session:
+        moved = archive_transactions(session, before, args.batch_size)
+    logger.info(f"Moved {moved} transactions sealed before {before.isoformat()} to the archive.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
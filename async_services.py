@@ -0,0 +1,168 @@
+import asyncio
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import Row
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import metrics
+import reconciliation
+import services
+from config import engine
+from models import (
+    Job, Transaction, Revision, SealedManifest, InclusionProof, BulkIngestResult, AccountBalance, TrialBalance, Rollup,
+    TransactionHistory, ReconciliationReport
+)
+from write_pipeline import WritePipeline
+
+# Async versions of the service functions. Each one runs the sync implementation through
+# AsyncSession.run_sync, so the business rules live in services.py while every DB round
+# trip is awaited on the async engine instead of blocking the event loop. The seal, which is
+# mostly CPU work, runs in a worker thread instead.
+
+# Set by the lifespan when group commit is enabled
+write_pipeline: Optional[WritePipeline] = None
+# The seal in progress, which concurrent seal requests wait on
+running_seal: Optional[asyncio.Future] = None
+
+
+def use_write_pipeline(pipeline: Optional[WritePipeline]):
+    global write_pipeline
+    write_pipeline = pipeline
+
+
+async def create_job(job: Job, session: AsyncSession) -> Job:
+    if write_pipeline:
+        return await write_pipeline.submit(services.add_job, job)
+    return await session.run_sync(lambda sync_session: services.create_job(job, sync_session))
+
+
+async def list_jobs(
+        session: AsyncSession, cursor: Optional[str] = None, limit: int = services.DEFAULT_PAGE_SIZE
+) -> Tuple[Sequence[Row], Optional[str]]:
+    return await session.run_sync(lambda sync_session: services.list_jobs(sync_session, cursor, limit))
+
+
+async def create_transaction(transaction: Transaction, session: AsyncSession) -> Transaction:
+    if write_pipeline:
+        return await write_pipeline.submit(services.add_transaction, transaction)
+    return await session.run_sync(lambda sync_session: services.create_transaction(transaction, sync_session))
+
+
+async def create_transactions_bulk(items: List, session: AsyncSession) -> BulkIngestResult:
+    return await session.run_sync(lambda sync_session: services.create_transactions_bulk(items, sync_session))
+
+
+async def list_transactions(
+        session: AsyncSession, cursor: Optional[str] = None, limit: int = services.DEFAULT_PAGE_SIZE,
+        order_by: str = "id"
+) -> Tuple[Sequence[Row], Optional[str]]:
+    return await session.run_sync(
+        lambda sync_session: services.list_transactions(sync_session, cursor, limit, order_by)
+    )
+
+
+async def transaction_source(
+        session: AsyncSession, cursor: Optional[str] = None, order_by: str = "id", start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+):
+    return await session.run_sync(
+        lambda sync_session: services.transaction_source(sync_session, cursor, order_by, start, end)
+    )
+
+
+async def list_effective_transactions(
+        session: AsyncSession, cursor: Optional[str] = None, limit: int = services.DEFAULT_PAGE_SIZE,
+        order_by: str = "id"
+) -> Tuple[Sequence[Row], Optional[str]]:
+    return await session.run_sync(
+        lambda sync_session: services.list_effective_transactions(sync_session, cursor, limit, order_by)
+    )
+
+
+async def transaction_history(transaction_id: int, session: AsyncSession) -> TransactionHistory:
+    return await session.run_sync(lambda sync_session: services.transaction_history(transaction_id, sync_session))
+
+
+async def seal_transactions(session: AsyncSession) -> SealedManifest:
+    # A seal requested while another one runs joins that run instead of scanning the ledger again
+    global running_seal
+    if running_seal is not None:
+        metrics.SEALS_COALESCED.inc()
+    else:
+        running_seal = asyncio.get_running_loop().run_in_executor(None, run_seal)
+        running_seal.add_done_callback(finish_seal)
+    # Shielded, so a caller that disconnects does not cancel the seal for the others
+    return await asyncio.shield(running_seal)
+
+
+def run_seal() -> SealedManifest:
+    # In a worker thread on a sync session, like the manifest check: fingerprinting, hashing and building the tree
+    # are CPU work that run_sync would do on the event loop, stalling every other request meanwhile. Its own
+    # session, as the one of the request that started it may close first.
+    with Session(engine, expire_on_commit=False) as session:
+        return services.seal_transactions(session)
+
+
+def finish_seal(task: asyncio.Task):
+    global running_seal
+    running_seal = None
+    # Retrieved here, so a failed seal whose callers have all gone does not log "exception never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+async def transaction_proof(transaction_id: int, session: AsyncSession) -> InclusionProof:
+    return await session.run_sync(lambda sync_session: services.transaction_proof(transaction_id, sync_session))
+
+
+async def revise_transaction(transaction_id: int, new_transaction: Transaction, session: AsyncSession) -> Revision:
+    if write_pipeline:
+        return await write_pipeline.submit(services.add_revision, transaction_id, new_transaction)
+    return await session.run_sync(
+        lambda sync_session: services.revise_transaction(transaction_id, new_transaction, sync_session)
+    )
+
+
+async def list_revisions(
+        session: AsyncSession, cursor: Optional[str] = None, limit: int = services.DEFAULT_PAGE_SIZE
+) -> Tuple[Sequence[Row], Optional[str]]:
+    return await session.run_sync(lambda sync_session: services.list_revisions(sync_session, cursor, limit))
+
+
+async def get_account_balance(account: str, session: AsyncSession) -> AccountBalance:
+    return await session.run_sync(lambda sync_session: services.get_account_balance(account, sync_session))
+
+
+async def search_transactions(
+        session: AsyncSession, account: Optional[str] = None, job_id: Optional[int] = None,
+        amount_min: Optional[float] = None, amount_max: Optional[float] = None, start: Optional[datetime] = None,
+        end: Optional[datetime] = None, cursor: Optional[str] = None, limit: int = services.DEFAULT_PAGE_SIZE
+) -> Tuple[Sequence[Row], Optional[str]]:
+    return await session.run_sync(lambda sync_session: services.search_transactions(
+        sync_session, account, job_id, amount_min, amount_max, start, end, cursor, limit
+    ))
+
+
+async def trial_balance(
+        session: AsyncSession, cursor: Optional[str] = None, limit: int = services.DEFAULT_PAGE_SIZE
+) -> Tuple[TrialBalance, Optional[str]]:
+    return await session.run_sync(lambda sync_session: services.trial_balance(sync_session, cursor, limit))
+
+
+async def rollup_report(
+        session: AsyncSession, job_id: Optional[int], account: Optional[str], start: datetime, end: datetime,
+        granularity: str
+) -> Sequence[Rollup]:
+    return await session.run_sync(
+        lambda sync_session: services.rollup_report(sync_session, job_id, account, start, end, granularity)
+    )
+
+
+async def reconcile(session: AsyncSession) -> ReconciliationReport:
+    return await session.run_sync(reconciliation.reconcile)
+
+
+async def outbox_depth(session: AsyncSession) -> int:
+    return await session.run_sync(services.outbox_depth)
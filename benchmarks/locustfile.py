@@ -0,0 +1,147 @@
+import logging
+import os
+import random
+from datetime import datetime, timezone
+from pathlib import Path
+
+from locust import HttpUser, between, events, tag, task
+
+from benchmarks.report import DEFAULT_TOLERANCE, compare, environment_changes, load_results, write_results
+
+# Locust configures logging itself
+logger = logging.getLogger(__name__)
+
+# Size of the ledger the target was seeded with (python inject_data.py --jobs ... --transactions ...)
+LEDGER_JOBS = int(os.getenv("LEDGER_JOBS", "1000"))
+LEDGER_TRANSACTIONS = int(os.getenv("LEDGER_TRANSACTIONS", "1000"))
+
+# inject_data's default span, so rollup reports hit populated buckets
+ROLLUP_WINDOW = "from=2024-01-01T00:00:00Z&to=2025-01-01T00:00:00Z"
+
+RESULTS_PATH = Path(os.getenv("LOCUST_RESULTS", Path(__file__).parent / "locust_results.json"))
+BASELINE_PATH = Path(os.getenv("LOCUST_BASELINE", Path(__file__).parent / "locust_baseline.json"))
+TOLERANCE = float(os.getenv("LOCUST_TOLERANCE", str(DEFAULT_TOLERANCE)))
+
+
+class LedgerUser(HttpUser):
+    # Roughly 80% reads, 18% writes and 2% seals, each aimed at a random row
+    wait_time = between(0.1, 1)
+    connection_timeout = 120.0
+    network_timeout = 120.0
+
+    def on_start(self):
+        page = self.client.get("/v1/accounts/trial-balance?limit=1000", name="/v1/accounts/trial-balance").json()
+        self.accounts = [balance["account"] for balance in page["accounts"]] or ["DE89370400440532013000"]
+
+    def transaction_id(self) -> int:
+        return random.randint(1, LEDGER_TRANSACTIONS)
+
+    def transaction(self) -> dict:
+        debit, credit = random.sample(self.accounts, 2) if len(self.accounts) > 1 else (self.accounts[0], "CASH")
+        return {
+            "job_id": random.randint(1, LEDGER_JOBS),
+            "account_debit": debit,
+            "account_credit": credit,
+            "amount": round(random.uniform(5, 150), 2),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+
+    @tag("read")
+    @task(20)
+    def list_transactions(self):
+        cursor = self.client.get("/v1/transactions/list?limit=100").headers.get("X-Next-Cursor")
+        if cursor:
+            self.client.get(f"/v1/transactions/list?limit=100&cursor={cursor}", name="/v1/transactions/list?cursor")
+
+    @tag("read")
+    @task(10)
+    def list_effective_transactions(self):
+        self.client.get("/v1/transactions/effective?limit=100")
+
+    @tag("read")
+    @task(15)
+    def account_balance(self):
+        self.client.get(f"/v1/accounts/{random.choice(self.accounts)}/balance", name="/v1/accounts/{account}/balance")
+
+    @tag("read")
+    @task(10)
+    def transaction_history(self):
+        self.client.get(f"/v1/transactions/{self.transaction_id()}/history",
+                        name="/v1/transactions/{transaction_id}/history")
+
+    @tag("read")
+    @task(10)
+    def transaction_proof(self):
+        with self.client.get(f"/v1/transactions/{self.transaction_id()}/proof",
+                             name="/v1/transactions/{transaction_id}/proof", catch_response=True) as response:
+            # Rows written during the run are not sealed yet
+            if response.status_code == 404:
+                response.success()
+
+    @tag("read")
+    @task(10)
+    def rollup_report(self):
+        self.client.get(
+            f"/v1/reports/rollup?job_id={random.randint(1, LEDGER_JOBS)}&granularity=month&{ROLLUP_WINDOW}",
+            name="/v1/reports/rollup",
+        )
+
+    @tag("read")
+    @task(5)
+    def list_jobs(self):
+        self.client.get("/v1/jobs/list?limit=100")
+
+    @tag("write")
+    @task(12)
+    def create_transaction(self):
+        self.client.post("/v1/transactions/create", json=self.transaction())
+
+    @tag("write")
+    @task(4)
+    def revise_transaction(self):
+        self.client.post(f"/v1/transactions/{self.transaction_id()}/revise", json=self.transaction(),
+                         name="/v1/transactions/{transaction_id}/revise")
+
+    @tag("write")
+    @task(1)
+    def create_transactions_bulk(self):
+        self.client.post("/v1/transactions/bulk", json=[self.transaction() for _ in range(100)])
+
+    @tag("write")
+    @task(1)
+    def create_job(self):
+        self.client.post("/v1/jobs/create", json={"name": "Driver", "description": "Load test driver"})
+
+    @tag("seal")
+    @task(2)
+    def seal_transactions(self):
+        with self.client.post("/v1/transactions/seal", catch_response=True) as response:
+            # Nothing new to seal is not an error under load
+            if response.status_code == 400:
+                response.success()
+
+
+@events.quitting.add_listener
+def record_results(environment, **kwargs):
+    results = {}
+    for entry in environment.stats.entries.values():
+        results[f"{entry.method} {entry.name}"] = {
+            "calls": entry.num_requests,
+            "failures": entry.num_failures,
+            "throughput": entry.total_rps,
+            "p50_ms": entry.get_response_time_percentile(0.5),
+            "p95_ms": entry.get_response_time_percentile(0.95),
+            "p99_ms": entry.get_response_time_percentile(0.99),
+        }
+    write_results(RESULTS_PATH, results)
+
+    baseline = load_results(BASELINE_PATH)
+    if baseline is None:
+        return
+    for change in environment_changes(BASELINE_PATH):
+        logger.warning(f"Baseline recorded on a different environment, {change}; timings may not compare.")
+    regressions = compare(results, baseline, TOLERANCE)
+    for regression in regressions:
+        logger.error(f"Regression: {regression}")
+    if regressions:
+        environment.process_exit_code = 1
@@ -0,0 +1,254 @@
+import argparse
+import logging
+import random
+import shutil
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+
+from sqlalchemy import event, func, text
+from sqlmodel import Session, create_engine, select
+
+from benchmarks.report import (
+    DEFAULT_TOLERANCE, compare, environment_changes, load_results, peak_alloc_kb, percentiles, write_results
+)
+from config import set_sqlite_pragmas
+from inject_data import DEFAULT_END, inject_data
+from models import Job, Transaction, Revision, AccountBalance, SealedManifest, MerkleNode
+import services
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = Path(__file__).parent
+DATA_DIR = BENCHMARK_DIR / "data"
+BASELINE_PATH = BENCHMARK_DIR / "baseline.json"
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_SEED = 42
+DEFAULT_ROUNDS = 3
+# Calls per benchmark traced for peak allocations
+MEMORY_CALLS = 10
+BULK_SIZE = 100
+
+
+@dataclass
+class Dataset:
+    # Id ranges and sample keys of a generated ledger, for picking random targets
+    max_job_id: int
+    max_transaction_id: int
+    revised_ids: Sequence[int]
+    sealed_ids: Sequence[int]
+    accounts: Sequence[str]
+    manifest_id: int
+
+
+@dataclass
+class Benchmark:
+    run: Callable[[Session, Dataset, random.Random], object]
+    iterations: int = 200
+    # Untimed work before each call, such as new rows for a seal to cover
+    setup: Optional[Callable[[Session, Dataset, random.Random], object]] = None
+
+
+def random_transaction(dataset: Dataset, rng: random.Random) -> Transaction:
+    debit, credit = rng.sample(dataset.accounts, 2)
+    return Transaction(job_id=rng.randint(1, dataset.max_job_id), account_debit=debit, account_credit=credit,
+                       amount=round(rng.uniform(5, 150), 2), timestamp=DEFAULT_END)
+
+
+def random_cursor(dataset: Dataset, rng: random.Random) -> str:
+    return services.encode_cursor(rng.randint(0, dataset.max_transaction_id))
+
+
+def bulk_items(dataset: Dataset, rng: random.Random) -> list:
+    return [
+        random_transaction(dataset, rng).model_dump(exclude={"id"}, mode="json") for _ in range(BULK_SIZE)
+    ]
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "list_jobs": Benchmark(lambda s, d, rng: services.list_jobs(s)),
+    "list_transactions": Benchmark(lambda s, d, rng: services.list_transactions(s, random_cursor(d, rng))),
+    "list_transactions_by_timestamp": Benchmark(
+        lambda s, d, rng: services.list_transactions(s, order_by="timestamp")
+    ),
+    "list_effective_transactions": Benchmark(
+        lambda s, d, rng: services.list_effective_transactions(s, random_cursor(d, rng))
+    ),
+    "list_revisions": Benchmark(lambda s, d, rng: services.list_revisions(s)),
+    "transaction_history": Benchmark(lambda s, d, rng: services.transaction_history(rng.choice(d.revised_ids), s)),
+    "transaction_proof": Benchmark(lambda s, d, rng: services.transaction_proof(rng.choice(d.sealed_ids), s)),
+    "account_balance": Benchmark(lambda s, d, rng: services.get_account_balance(rng.choice(d.accounts), s)),
+    "trial_balance": Benchmark(lambda s, d, rng: services.trial_balance(s), iterations=50),
+    "rollup_report": Benchmark(lambda s, d, rng: services.rollup_report(
+        s, rng.randint(1, d.max_job_id), None, DEFAULT_END.replace(year=DEFAULT_END.year - 1), DEFAULT_END, "month"
+    )),
+    "verify_manifest": Benchmark(lambda s, d, rng: services.verify_manifest(d.manifest_id, s), iterations=3),
+    # Writes run last, so the reads above see the dataset as generated
+    "create_job": Benchmark(lambda s, d, rng: services.create_job(Job(name="Benchmark driver"), s)),
+    "create_transaction": Benchmark(lambda s, d, rng: services.create_transaction(random_transaction(d, rng), s)),
+    "revise_transaction": Benchmark(lambda s, d, rng: services.revise_transaction(
+        rng.randint(1, d.max_transaction_id), random_transaction(d, rng), s
+    )),
+    "create_transactions_bulk": Benchmark(
+        lambda s, d, rng: services.create_transactions_bulk(bulk_items(d, rng), s), iterations=20
+    ),
+    "seal_transactions": Benchmark(
+        lambda s, d, rng: services.seal_transactions(s), iterations=20,
+        setup=lambda s, d, rng: services.create_transactions_bulk(bulk_items(d, rng), s),
+    ),
+}
+
+
+def benchmark_engine(path: Path):
+    db_engine = create_engine(f"sqlite:///{path}")
+    event.listen(db_engine, "connect", set_sqlite_pragmas)
+    return db_engine
+
+
+def dataset_path(size: int, seed: int) -> Path:
+    # Generated once per size and seed and reused; every run works on a copy
+    path = DATA_DIR / f"ledger_{size}_{seed}.db"
+    if not path.exists():
+        DATA_DIR.mkdir(exist_ok=True)
+        partial = path.with_suffix(".partial")
+        db_engine = benchmark_engine(partial)
+        inject_data(jobs=max(size // 100, 10), transactions=size, seed=seed, workers=1, accounts=min(size, 10000),
+                    db_engine=db_engine)
+        with db_engine.connect() as connection:
+            connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        db_engine.dispose()
+        partial.rename(path)
+    return path
+
+
+def load_dataset(session: Session, rng: random.Random) -> Dataset:
+    accounts = session.exec(select(AccountBalance.account)).all()
+    revised_ids = session.exec(select(Revision.original_transaction_id)).all()
+    sealed_ids = session.exec(select(MerkleNode.transaction_id).where(MerkleNode.level == 0)).all()
+    return Dataset(
+        max_job_id=session.exec(select(func.max(Job.id))).one(),
+        max_transaction_id=session.exec(select(func.max(Transaction.id))).one(),
+        revised_ids=revised_ids,
+        sealed_ids=rng.sample(sealed_ids, min(len(sealed_ids), 1000)),
+        accounts=accounts,
+        manifest_id=session.exec(select(func.min(SealedManifest.id))).one(),
+    )
+
+
+def measure(benchmark: Benchmark, db_engine, dataset: Dataset, rng: random.Random, rounds: int = DEFAULT_ROUNDS) -> dict:
+    queries = 0
+    counting = False
+
+    def count_query(*args):
+        nonlocal queries
+        queries += counting
+
+    def timed_round(iterations: int) -> list:
+        nonlocal counting
+        samples = []
+        for _ in range(iterations):
+            # A fresh session per call, as each request gets
+            with Session(db_engine) as session:
+                if benchmark.setup:
+                    benchmark.setup(session, dataset, rng)
+                counting = True
+                started = time.perf_counter()
+                benchmark.run(session, dataset, rng)
+                samples.append((time.perf_counter() - started) * 1000)
+                counting = False
+        return samples
+
+    event.listen(db_engine, "before_cursor_execute", count_query)
+    try:
+        # One untimed call warms the statement caches; the fastest round is kept, as on a shared machine the
+        # slower ones mostly measure other processes
+        timed_round(1)
+        queries = 0
+        all_rounds = [timed_round(benchmark.iterations) for _ in range(rounds)]
+    finally:
+        event.remove(db_engine, "before_cursor_execute", count_query)
+
+    # Allocations are traced on calls of their own, as tracing slows every call down; the largest peak counts
+    peaks = []
+    for _ in range(min(benchmark.iterations, MEMORY_CALLS)):
+        with Session(db_engine) as session:
+            if benchmark.setup:
+                benchmark.setup(session, dataset, rng)
+            peaks.append(peak_alloc_kb(lambda: benchmark.run(session, dataset, rng)))
+
+    samples = min(all_rounds, key=sum)
+    calls = benchmark.iterations * rounds
+    return {
+        "calls": len(samples),
+        "throughput": len(samples) / (sum(samples) / 1000),
+        **percentiles(samples),
+        "queries_per_call": queries / calls,
+        "peak_alloc_kb": max(peaks),
+    }
+
+
+def run(sizes: Sequence[int], seed: int = DEFAULT_SEED, names: Optional[Sequence[str]] = None,
+        rounds: int = DEFAULT_ROUNDS, work_dir: Path = DATA_DIR) -> dict:
+    results = {}
+    for size in sizes:
+        source = dataset_path(size, seed)
+        work_dir.mkdir(exist_ok=True)
+        scratch = work_dir / f"scratch_{size}_{seed}.db"
+        shutil.copyfile(source, scratch)
+        db_engine = benchmark_engine(scratch)
+        rng = random.Random(seed)
+        with Session(db_engine) as session:
+            dataset = load_dataset(session, rng)
+
+        results[str(size)] = {}
+        for name, benchmark in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            results[str(size)][name] = metrics = measure(benchmark, db_engine, dataset, rng, rounds)
+            logger.info(
+                f"{size} rows, {name}: {metrics['throughput']:.0f} calls/sec, p50 {metrics['p50_ms']:.2f} ms, "
+                f"p99 {metrics['p99_ms']:.2f} ms, {metrics['queries_per_call']:.1f} queries/call, "
+                f"peak {metrics['peak_alloc_kb']:.0f} KiB allocated"
+            )
+        db_engine.dispose()
+        scratch.unlink()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the service layer on generated ledgers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Transactions per dataset.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed for the datasets and random targets.")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="Only run these benchmarks.")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Rounds per benchmark; the fastest counts.")
+    parser.add_argument("--output", type=Path, default=BENCHMARK_DIR / "results.json", help="Where to write results.")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative slowdown before a metric counts as a regression.")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline.")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.seed, args.only, args.rounds)
+    write_results(args.output, results)
+    if args.update_baseline:
+        write_results(args.baseline, results)
+        return
+
+    baseline = load_results(args.baseline)
+    if baseline is None:
+        logger.warning(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return
+    for change in environment_changes(args.baseline):
+        logger.warning(f"Baseline recorded on a different environment, {change}; timings may not compare.")
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        logger.error(f"Regression: {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
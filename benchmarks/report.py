@@ -0,0 +1,97 @@
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import sqlalchemy
+
+# Relative slack allowed on timing and memory metrics before a run counts as a regression
+DEFAULT_TOLERANCE = 0.3
+
+# Metrics checked against the baseline -> True if higher is better; p50 and p99 are recorded but too
+# noisy over a few hundred calls to gate on
+METRICS = {
+    "throughput": True,
+    "p95_ms": False,
+    "queries_per_call": False,
+    "peak_alloc_kb": False,
+}
+
+
+def percentiles(samples_ms: Sequence[float]) -> Dict[str, float]:
+    if len(samples_ms) < 2:
+        value = samples_ms[0] if samples_ms else 0.0
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(samples_ms, n=100, method="inclusive")
+    return {"p50_ms": cuts[49], "p95_ms": cuts[94], "p99_ms": cuts[98]}
+
+
+def peak_alloc_kb(call: Callable[[], object]) -> float:
+    # Peak Python heap growth during this one call. Process RSS is a high-water mark over the whole run, so it would
+    # charge every benchmark with the largest one run before it.
+    tracemalloc.start()
+    try:
+        started, _ = tracemalloc.get_traced_memory()
+        call()
+        return (tracemalloc.get_traced_memory()[1] - started) / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def environment() -> dict:
+    # Everything a baseline's numbers depend on besides the code: timings follow the machine, and query plans the
+    # SQLite version
+    return {
+        "python": f"{platform.python_implementation()} {platform.python_version()}",
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+        "sqlalchemy": sqlalchemy.__version__,
+    }
+
+
+def write_results(path: Path, results: dict):
+    path.write_text(json.dumps({"environment": environment(), "results": results}, indent=2, sort_keys=True) + "\n")
+
+
+def load_results(path: Path) -> Optional[dict]:
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())["results"]
+
+
+def environment_changes(path: Path) -> List[str]:
+    # Where this machine differs from the one that recorded the results at path
+    recorded = json.loads(path.read_text()).get("environment", {})
+    return [f"{name}: {recorded.get(name)} (now {value})" for name, value in environment().items()
+            if recorded.get(name) != value]
+
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE, prefix: str = "") -> List[str]:
+    # Walks both trees and reports every metric that is worse than its baseline by more than the tolerance;
+    # query counts are deterministic, so any increase is a regression
+    regressions = []
+    for name, value in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if isinstance(value, dict):
+            regressions.extend(compare(value, expected, tolerance, f"{prefix}{name}."))
+            continue
+        if name not in METRICS:
+            continue
+        if name == "queries_per_call":
+            worse = value > expected
+        elif METRICS[name]:
+            worse = value < expected * (1 - tolerance)
+        else:
+            worse = value > expected * (1 + tolerance)
+        if worse:
+            regressions.append(f"{prefix}{name}: {value:.2f} (baseline {expected:.2f})")
+    return regressions
@@ -0,0 +1,71 @@
+import argparse
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Sequence
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlmodel import Session, select
+
+from benchmarks.micro import DEFAULT_SEED, benchmark_engine, dataset_path
+from benchmarks.report import percentiles
+from models import Transaction
+import services
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_ROUNDS = 5
+TRANSACTIONS = TypeAdapter(List[Transaction])
+
+
+def model_path(session: Session, limit: int) -> bytes:
+    # What a response_model=List[Transaction] route did: ORM instances, validated again, encoded with json
+    rows = session.exec(select(Transaction).order_by(Transaction.id).limit(limit)).all()
+    return json.dumps(jsonable_encoder(TRANSACTIONS.validate_python(rows, from_attributes=True))).encode()
+
+
+def row_path(session: Session, limit: int) -> bytes:
+    rows = session.exec(services.table_columns(Transaction).order_by(Transaction.id).limit(limit)).all()
+    return services.encode_rows(rows)
+
+
+PATHS: Dict[str, Callable[[Session, int], bytes]] = {"model": model_path, "row": row_path}
+
+
+def run(sizes: Sequence[int], seed: int = DEFAULT_SEED, rounds: int = DEFAULT_ROUNDS) -> dict:
+    results = {}
+    for size in sizes:
+        db_engine = benchmark_engine(dataset_path(size, seed))
+        results[str(size)] = {}
+        for name, path in PATHS.items():
+            samples = []
+            with Session(db_engine) as session:
+                path(session, size)
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    body = path(session, size)
+                    samples.append((time.perf_counter() - started) * 1000)
+            results[str(size)][name] = {"rows_per_sec": size / (min(samples) / 1000), "bytes": len(body),
+                                        **percentiles(samples)}
+        db_engine.dispose()
+
+        model, row = results[str(size)]["model"], results[str(size)]["row"]
+        logger.info(f"{size} rows: model path {model['p50_ms']:.1f} ms, row path {row['p50_ms']:.1f} ms "
+                    f"({row['rows_per_sec'] / model['rows_per_sec']:.1f}x)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the model and row serialization paths on list pages.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Rows per page.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the generated datasets.")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Timed rounds per path and size.")
+    args = parser.parse_args()
+    run(args.sizes, args.seed, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
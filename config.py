@@ -1,10 +1,120 @@
 import os
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import create_engine
 
+from metrics import TimedAsyncAdaptedQueuePool, TimedQueuePool, instrument_engine
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database.db")
+
+# Async driver for each sync URL scheme, used by the request handlers
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    # The same database through its async driver; schemes without a known driver are kept as they are
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", async_database_url(DATABASE_URL))
+
+# Per process; serve.py divides them between its workers
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 50))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 100))
+
 engine = create_engine(
     DATABASE_URL,
-    pool_size=50,
-    max_overflow=100,
-    pool_timeout=60
-)
\ No newline at end of file
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=60,
+    poolclass=TimedQueuePool
+)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=60,
+    poolclass=TimedAsyncAdaptedQueuePool
+)
+
+# Query count and time for /metrics
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+# SQLite pragmas: WAL lets readers run alongside the single writer, and busy_timeout waits
+# for the write lock instead of failing straight away
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+# Group commit: opt-in single writer that batches concurrent writes into one transaction
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", 2))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", 256))
+
+# Requests slower than this log every statement they ran; 0 turns the log off
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+
+# Read-through cache of list pages and their ETags, invalidated by per-table generation counters. The counters
+# live in process memory and only see writes made through this process, so the cache is opt-in: turn it on only
+# where one process is the ledger's sole writer.
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Admission control: per route class, (requests running, requests queued, seconds a request may wait in the queue).
+# Limits are per process; anything over them is rejected at once with 429 or 503 and Retry-After.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+ADMISSION_LIMITS = {
+    route_class: (
+        int(os.getenv(f"ADMISSION_{route_class.upper()}_CONCURRENCY", concurrency)),
+        int(os.getenv(f"ADMISSION_{route_class.upper()}_QUEUE", queue_size)),
+        float(os.getenv(f"ADMISSION_{route_class.upper()}_QUEUE_TIMEOUT", queue_timeout)),
+    )
+    for route_class, (concurrency, queue_size, queue_timeout) in {
+        "read": (64, 256, 2.0),
+        # SQLite has a single writer, so more concurrent writes would only queue on its lock and the pool
+        "write": (16, 64, 5.0),
+        "expensive": (2, 8, 30.0),
+    }.items()
+} if ADMISSION_CONTROL else {}
+
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", os.cpu_count() or 1))
+
+# Event sink: kafka, memory, file (append-only NDJSON) or noop. The file sink is the default as it needs no broker at
+# startup and, unlike memory or noop, keeps every event; Kafka deployments set EVENT_SINK=kafka.
+EVENT_SINK = os.getenv("EVENT_SINK", "file")
+EVENT_SINK_PATH = os.getenv("EVENT_SINK_PATH", "events.ndjson")
+
+# Kafka producer tuning
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE", "gzip")
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", 20))
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", 64 * 1024))
+KAFKA_RETRIES = int(os.getenv("KAFKA_RETRIES", 5))
+
+# Outbox dispatcher
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 500))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 0.5))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", 30.0))
+OUTBOX_FLUSH_TIMEOUT = float(os.getenv("OUTBOX_FLUSH_TIMEOUT", 10.0))
+# Off in serve.py's workers, whose launcher runs the one dispatcher instead
+OUTBOX_DISPATCHER = os.getenv("OUTBOX_DISPATCHER", "true").lower() in ("1", "true", "yes")
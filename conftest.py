@@ -0,0 +1,21 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# config creates its engines when it is imported, so the tests' database is chosen here, before any test module
+# imports it. A fresh file per run keeps the tests away from database.db and from rows left by an earlier run.
+TEST_DATABASE_DIR = tempfile.mkdtemp(prefix="ledger-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DATABASE_DIR, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def test_database():
+    # The app's lifespan creates the schema, but the tests call the app without starting it
+    from dependencies import create_schema
+
+    create_schema()
+    yield
+    shutil.rmtree(TEST_DATABASE_DIR, ignore_errors=True)
@@ -1,6 +1,11 @@
 from contextlib import asynccontextmanager
 from sqlmodel import Session, SQLModel
-from config import engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from config import engine, async_engine, OUTBOX_DISPATCHER, OUTBOX_FLUSH_TIMEOUT, GROUP_COMMIT
+from event_sinks import create_event_sink
+from outbox import OutboxDispatcher
+from write_pipeline import WritePipeline
+import async_services
 
 
 def get_session():
@@ -8,10 +13,49 @@ def get_session():
         yield session
 
 
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+def create_schema():
+    SQLModel.metadata.create_all(engine)
+    # create_all skips tables that already exist, so indexes added to a model later are created here
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
 @asynccontextmanager
 async def lifespan(app):
-    SQLModel.metadata.create_all(engine)
+    # Runs in each worker. Pooled connections inherited from a parent that forked after import belong to the
+    # parent, so they are dropped without being closed.
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+    create_schema()
     print("Database Initialized.")
+
+    # The event sink connects here rather than at import time
+    event_sink = create_event_sink() if OUTBOX_DISPATCHER else None
+    dispatcher = OutboxDispatcher(event_sink, engine) if OUTBOX_DISPATCHER else None
+    if dispatcher:
+        dispatcher.start()
+    app.state.event_sink = event_sink
+
+    write_pipeline = WritePipeline(async_engine) if GROUP_COMMIT else None
+    if write_pipeline:
+        write_pipeline.start()
+        async_services.use_write_pipeline(write_pipeline)
     yield
+    if write_pipeline:
+        async_services.use_write_pipeline(None)
+        await write_pipeline.stop()
+    if dispatcher:
+        dispatcher.stop()
+        event_sink.flush(timeout=OUTBOX_FLUSH_TIMEOUT)
+        event_sink.close(timeout=OUTBOX_FLUSH_TIMEOUT)
+    await async_engine.dispose()
+    engine.dispose()
 
 
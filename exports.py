@@ -0,0 +1,189 @@
+import argparse
+import csv
+import importlib.util
+import io
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import Row
+from sqlmodel import Session
+
+from config import engine
+import archive
+from models import Transaction
+from rollups import as_utc
+import services
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 50000
+COLUMNS = tuple(column.name for column in Transaction.__table__.columns)
+TIMESTAMP = COLUMNS.index("timestamp")
+
+
+def export_query(start: datetime, end: datetime, source=Transaction):
+    # Half-open window, so consecutive months never share a row; (timestamp, id) is the timestamp index's own order
+    return (
+        services.table_columns(source)
+        .where(source.timestamp >= as_utc(start), source.timestamp < as_utc(end))
+        .order_by(source.timestamp, source.id)
+    )
+
+
+def row_batches(session: Session, start: datetime, end: datetime,
+                chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Sequence[Row]]:
+    source = archive.transaction_source(session, start=as_utc(start), end=as_utc(end))
+    result = session.exec(export_query(start, end, source).execution_options(yield_per=chunk_size))
+    yield from result.partitions()
+
+
+def column_batch(rows: Sequence[Row]) -> List[list]:
+    return [list(column) for column in zip(*rows)]
+
+
+class ChunkSink(io.RawIOBase):
+    # Holds what a writer produced since the last drain, so a file is streamed out batch by batch
+    def __init__(self):
+        super().__init__()
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def csv_chunks(batches: Iterable[Sequence[Row]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        columns = column_batch(rows)
+        columns[TIMESTAMP] = [as_utc(timestamp).isoformat() for timestamp in columns[TIMESTAMP]]
+        writer.writerows(zip(*columns))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def arrow_schema(pa):
+    return pa.schema([
+        ("id", pa.int64()),
+        ("job_id", pa.int64()),
+        ("account_debit", pa.string()),
+        ("account_credit", pa.string()),
+        ("amount", pa.float64()),
+        # Naive values are read as UTC, as SQLite stores them without an offset
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+def columnar_chunks(batches: Iterable[Sequence[Row]], open_writer: Callable) -> Iterator[bytes]:
+    # Imported here so CSV exports work without pyarrow installed
+    import pyarrow as pa
+
+    schema = arrow_schema(pa)
+    sink = ChunkSink()
+    with open_writer(sink, schema) as writer:
+        for rows in batches:
+            columns = column_batch(rows)
+            writer.write_batch(pa.record_batch(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+            ))
+            yield sink.drain()
+    # The footer is written on close
+    yield sink.drain()
+
+
+def arrow_chunks(batches: Iterable[Sequence[Row]]) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    # The IPC file format rather than the stream format, so the export can be memory-mapped
+    return columnar_chunks(batches, pa.ipc.new_file)
+
+
+def parquet_chunks(batches: Iterable[Sequence[Row]]) -> Iterator[bytes]:
+    import pyarrow.parquet as pq
+
+    # One row group per chunk
+    return columnar_chunks(batches, pq.ParquetWriter)
+
+
+@dataclass
+class ExportFormat:
+    media_type: str
+    suffix: str
+    write: Callable[[Iterable[Sequence[Row]]], Iterator[bytes]]
+    requires: str = ""
+
+
+FORMATS: Dict[str, ExportFormat] = {
+    "csv": ExportFormat("text/csv; charset=utf-8", "csv", csv_chunks),
+    "arrow": ExportFormat("application/vnd.apache.arrow.file", "arrow", arrow_chunks, requires="pyarrow"),
+    "parquet": ExportFormat("application/vnd.apache.parquet", "parquet", parquet_chunks, requires="pyarrow"),
+}
+
+
+def export_format(name: str, start: datetime, end: datetime) -> ExportFormat:
+    # Checked before streaming starts, since errors can no longer change the status once the body is under way
+    if as_utc(start) > as_utc(end):
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'.")
+    chosen = FORMATS[name]
+    if chosen.requires and importlib.util.find_spec(chosen.requires) is None:
+        raise HTTPException(status_code=501, detail=f"The {name} format needs {chosen.requires} installed.")
+    return chosen
+
+
+def export_stream(start: datetime, end: datetime, chosen: ExportFormat, chunk_size: int = EXPORT_CHUNK_SIZE,
+                  db_engine=None) -> Iterator[bytes]:
+    # Runs after the request session is gone, so it owns its session
+    with Session(db_engine or engine) as session:
+        yield from chosen.write(row_batches(session, start, end, chunk_size))
+
+
+def export_to_file(path: Path, start: datetime, end: datetime, name: str, chunk_size: int = EXPORT_CHUNK_SIZE,
+                   db_engine=None) -> int:
+    written = 0
+    with open(path, "wb") as file:
+        for chunk in export_stream(start, end, export_format(name, start, end), chunk_size, db_engine):
+            file.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the transactions in a time window to a file.")
+    parser.add_argument("--from", dest="start", type=datetime.fromisoformat, required=True,
+                        help="First timestamp to include (ISO 8601, UTC).")
+    parser.add_argument("--to", dest="end", type=datetime.fromisoformat, required=True,
+                        help="Timestamp to stop before (ISO 8601, UTC).")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv", help="Output format.")
+    parser.add_argument("--output", type=Path, help="File to write; defaults to transactions.<format>.")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="Rows read and written per batch.")
+    args = parser.parse_args()
+
+    output = args.output or Path(f"transactions.{FORMATS[args.format].suffix}")
+    written = export_to_file(output, args.start, args.end, args.format, args.chunk_size)
+    logger.info(f"Wrote {written} bytes to {output}.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
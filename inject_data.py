@@ -1,80 +1,228 @@
-import hashlib
+import argparse
 import logging
-from datetime import datetime, timezone
+import multiprocessing
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 from faker import Faker
-from sqlmodel import Session
+from sqlalchemy import func, insert, text
+from sqlmodel import Session, SQLModel, select
 from tqdm import tqdm
 
 from config import engine
-from models import Job, Transaction, Revision, SealedManifest
+from models import Job, Transaction, Revision, TransactionVersion
+import rollups
+import services
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-fake = Faker()
-
-
-def inject_data():
-    with Session(engine) as session:
-        # Create sample jobs (drivers)
-        jobs = []
-        logger.info("Creating sample drivers...")
-        for _ in tqdm(range(1000), desc="Drivers"):
-            job = Job(name=fake.name(), description=f"Driver with {fake.random_int(min=1, max=20)} years of experience.")
-            jobs.append(job)
-        session.add_all(jobs)
-        session.commit()
-        for job in jobs:
-            session.refresh(job)  # Refresh to get IDs
-        logger.info("Sample drivers created.")
-
-        job_ids = [job.id for job in jobs]
-
-        # Create sample transactions (rides) and revisions
-        transactions = []
-        revisions = []
-        logger.info("Creating sample rides and revisions...")
-        for _ in tqdm(range(1000), desc="Rides and Revisions"):
-            transaction = Transaction(
-                job_id=fake.random_element(elements=job_ids),
-                account_debit=fake.iban(),
-                account_credit=fake.iban(),
-                amount=round(fake.random_number(digits=2) + fake.random.random(), 2),  # Ride fare
-                timestamp=fake.date_time_between(start_date='-1y', end_date='now', tzinfo=timezone.utc),
-            )
-            session.add(transaction)
-            session.flush()  # Crucial: Get the transaction ID
-            transactions.append(transaction)
-
-            if fake.boolean(chance_of_getting_true=10):  # 10% chance of revision
-                corrected_transaction = fake.random_element(elements=transactions)
-                revision = Revision(
-                    original_transaction_id=transaction.id,
-                    corrected_transaction_id=corrected_transaction.id,
-                    reason=fake.sentence(),
-                    timestamp=datetime.now(timezone.utc),
-                )
-                revisions.append(revision)
-
-        session.add_all(revisions)
-        session.commit()
-        logger.info("Sample rides and revisions created.")
-
-        # Create sample sealed manifest
-        logger.info("Creating sample sealed manifest...")
-        transactions_data = "".join([str(txn.id) for txn in transactions])
-        checksum = hashlib.sha256(transactions_data.encode()).hexdigest()
-        manifest = SealedManifest(
-            transaction_count=len(transactions),
-            checksum=checksum,
-            sealed_at=datetime.now(timezone.utc),
-        )
-        session.add(manifest)
-        session.commit()
-        logger.info("Sample sealed manifest created.")
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_ACCOUNTS = 10000
+NAME_POOL_SIZE = 1000
+# Rides end here unless told otherwise, so a seed always gives the same timestamps
+DEFAULT_END = datetime(2025, 1, 1, tzinfo=timezone.utc)
+REVISION_REASONS = ("Fare adjustment", "Toll added", "Wrong distance", "Promo code applied", "Duplicate charge")
+
+# Per-process pools, set once by init_worker instead of being pickled with every batch
+_accounts: Sequence[str] = ()
+_names: Sequence[str] = ()
+
+
+def init_worker(accounts: Sequence[str], names: Sequence[str]):
+    global _accounts, _names
+    _accounts, _names = accounts, names
+
+
+def batch_rng(seed: int, index: int) -> random.Random:
+    # Each batch has its own stream, so the output does not depend on how batches are spread over workers
+    return random.Random(f"{seed}:{index}")
+
+
+def revision_count(size: int, revision_ratio: float) -> int:
+    return round(size * revision_ratio)
+
+
+def generate_jobs(seed: int, index: int, first_id: int, size: int, created_at: datetime) -> List[dict]:
+    rng = batch_rng(seed, -index - 1)
+    names = rng.choices(_names, k=size)
+    experience = [rng.randint(1, 20) for _ in range(size)]
+    return [
+        {"id": first_id + offset, "name": names[offset],
+         "description": f"Driver with {experience[offset]} years of experience.", "created_at": created_at}
+        for offset in range(size)
+    ]
+
+
+def generate_transactions(seed: int, index: int, first_id: int, size: int, first_correction_id: int,
+                          revision_ratio: float, job_ids: Tuple[int, int], start: datetime,
+                          span_seconds: float) -> Tuple[List[dict], List[dict], List[dict], List[dict]]:
+    rng = batch_rng(seed, index)
+    account_count = len(_accounts)
+
+    # Draw each column for the whole batch at once
+    jobs = [rng.randint(*job_ids) for _ in range(size)]
+    debits = [rng.randrange(account_count) for _ in range(size)]
+    credit_offsets = [rng.randrange(1, account_count) for _ in range(size)]
+    amounts = [round(rng.uniform(5, 150), 2) for _ in range(size)]
+    offsets = sorted(rng.random() * span_seconds for _ in range(size))
+
+    transactions = [
+        {
+            "id": first_id + row,
+            "job_id": jobs[row],
+            "account_debit": _accounts[debits[row]],
+            "account_credit": _accounts[(debits[row] + credit_offsets[row]) % account_count],
+            "amount": amounts[row],
+            "timestamp": start + timedelta(seconds=offsets[row]),
+        }
+        for row in range(size)
+    ]
+
+    # Corrections take their ids from a block after all the rides and revise a ride's fare once
+    corrections, revisions, versions = [], [], []
+    revised = sorted(rng.sample(range(size), revision_count(size, revision_ratio)))
+    for correction_id, row in enumerate(revised, first_correction_id):
+        original = transactions[row]
+        amount = round(original["amount"] * rng.uniform(0.5, 1.5), 2)
+        corrections.append({**original, "id": correction_id, "amount": amount})
+        revisions.append({
+            "original_transaction_id": original["id"],
+            "corrected_transaction_id": correction_id,
+            "reason": rng.choice(REVISION_REASONS),
+            "timestamp": original["timestamp"] + timedelta(minutes=rng.randint(1, 60 * 24)),
+        })
+        versions.append({"transaction_id": original["id"], "root_transaction_id": original["id"],
+                         "effective_transaction_id": correction_id, "superseded": True})
+        versions.append({"transaction_id": correction_id, "root_transaction_id": original["id"],
+                         "effective_transaction_id": correction_id, "superseded": False})
+    return transactions, corrections, revisions, versions
+
+
+def generated_batches(tasks: List[tuple], generate, workers: int, pools: tuple) -> Iterator:
+    if workers <= 1:
+        init_worker(*pools)
+        for task in tasks:
+            yield generate(*task)
+        return
+
+    # Same bounded window as merkle.hash_leaves_parallel, keeping batches in order
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                             initargs=pools) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(generate, *task))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batch_sizes(total: int, batch_size: int) -> List[int]:
+    return [min(batch_size, total - first) for first in range(0, total, batch_size)]
+
+
+def next_id(connection, model) -> int:
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def reset_sequences(connection):
+    # Rows were inserted with explicit ids, which Postgres sequences do not see
+    for model in (Job, Transaction, Revision, TransactionVersion):
+        table = model.__tablename__
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), (SELECT max(id) FROM \"{table}\"))"
+        ))
+
+
+def inject_data(jobs: int = 1000, transactions: int = 1000, revision_ratio: float = 0.1, days: int = 365,
+                seed: int = 0, batch_size: int = DEFAULT_BATCH_SIZE, workers: int = 1,
+                accounts: int = DEFAULT_ACCOUNTS, seal: bool = True, end: Optional[datetime] = None,
+                db_engine=None):
+    db_engine = db_engine or engine
+    SQLModel.metadata.create_all(db_engine)
+    end = end or DEFAULT_END
+    start = end - timedelta(days=days)
+
+    fake = Faker()
+    fake.seed_instance(seed)
+    pools = ([fake.iban() for _ in range(accounts)], [fake.name() for _ in range(NAME_POOL_SIZE)])
+
+    with db_engine.connect() as connection:
+        first_job_id = next_id(connection, Job)
+        first_transaction_id = next_id(connection, Transaction)
+
+    # Rows are inserted with precomputed ids, so every batch can be generated independently
+    job_tasks, first_id = [], first_job_id
+    for index, size in enumerate(batch_sizes(jobs, batch_size)):
+        job_tasks.append((seed, index, first_id, size, start))
+        first_id += size
+    job_ids = (first_job_id, first_id - 1)
+
+    transaction_tasks, first_id, first_correction_id = [], first_transaction_id, first_transaction_id + transactions
+    for index, size in enumerate(batch_sizes(transactions, batch_size)):
+        transaction_tasks.append((seed, index, first_id, size, first_correction_id, revision_ratio, job_ids, start,
+                                  (end - start).total_seconds()))
+        first_id += size
+        first_correction_id += revision_count(size, revision_ratio)
+
+    logger.info("Creating sample drivers...")
+    for rows in tqdm(generated_batches(job_tasks, generate_jobs, workers, pools), total=len(job_tasks),
+                     desc="Drivers"):
+        with db_engine.begin() as connection:
+            connection.execute(insert(Job), rows)
+
+    logger.info("Creating sample rides and revisions...")
+    revision_total = 0
+    for rides, corrections, revisions, versions in tqdm(
+        generated_batches(transaction_tasks, generate_transactions, workers, pools), total=len(transaction_tasks),
+        desc="Rides and Revisions"
+    ):
+        # One executemany per table and one commit per batch
+        with db_engine.begin() as connection:
+            connection.execute(insert(Transaction), rides + corrections)
+            if revisions:
+                connection.execute(insert(Revision), revisions)
+                connection.execute(insert(TransactionVersion), versions)
+        revision_total += len(revisions)
+
+    if db_engine.dialect.name == "postgresql":
+        with db_engine.begin() as connection:
+            reset_sequences(connection)
+    logger.info(f"Created {jobs} drivers, {transactions} rides and {revision_total} revisions.")
+
+    # Balances and rollups are derived from the effective ledger in one pass each
+    with Session(db_engine) as session:
+        logger.info("Rebuilding account balances and rollups...")
+        services.rebuild_account_balances(session)
+        rollups.backfill(session)
+        if seal:
+            logger.info("Sealing sample rides...")
+            services.seal_transactions(session)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the database with reproducible synthetic rides.")
+    parser.add_argument("--jobs", type=int, default=1000, help="Drivers to create.")
+    parser.add_argument("--transactions", type=int, default=1000, help="Rides to create, not counting corrections.")
+    parser.add_argument("--revision-ratio", type=float, default=0.1, help="Share of rides that get a correction.")
+    parser.add_argument("--days", type=int, default=365, help="Rides are spread over this many days.")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=DEFAULT_END,
+                        help="Timestamp of the latest possible ride (ISO 8601, UTC).")
+    parser.add_argument("--seed", type=int, default=0, help="Same seed and sizes give the same rows.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per batch and commit.")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="Generator processes.")
+    parser.add_argument("--accounts", type=int, default=DEFAULT_ACCOUNTS, help="Size of the IBAN pool.")
+    parser.add_argument("--no-seal", action="store_true", help="Skip sealing the generated rides.")
+    args = parser.parse_args()
+    inject_data(args.jobs, args.transactions, args.revision_ratio, args.days, args.seed, args.batch_size,
+                args.workers, args.accounts, not args.no_seal, rollups.as_utc(args.end))
 
 
 if __name__ == "__main__":
-    inject_data()
\ No newline at end of file
+    main()
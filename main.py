@@ -1,11 +1,24 @@
-from typing import List
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
 
 import uvicorn
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import Row
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from dependencies import get_session, lifespan
-from models import Job, Transaction, Revision, SealedManifest
+from config import RESPONSE_CACHE, SLOW_REQUEST_MS
+from dependencies import get_session, get_async_session, lifespan
+from models import (
+    Job, Transaction, Revision, SealedManifest, InclusionProof, ManifestVerification, BulkIngestResult, AccountBalance,
+    TrialBalance, Rollup, TransactionHistory, ReconciliationReport
+)
+import admission
+import async_services
+import exports
+import metrics
+import response_cache
 import services
 
 # FastAPI App Initialization
@@ -14,50 +27,233 @@ app = FastAPI(
     title="Accounting API 💼",
     version="0.1.0",
     description="API for accounting operations.",
-    docs_url="/"
+    docs_url="/",
+    default_response_class=ORJSONResponse
 )
+# Added first so it runs inside the metrics middleware, which then also times and counts rejections
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware, slow_request_ms=SLOW_REQUEST_MS)
+
+
+NDJSON_MEDIA_TYPE = services.NDJSON_MEDIA_TYPE
+PageSize = Query(services.DEFAULT_PAGE_SIZE, ge=1, le=services.MAX_PAGE_SIZE)
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+
+async def cached_page(
+        request: Request, tables: Sequence[str], load: Callable[[], Awaitable[Tuple[Sequence[Row], Optional[str]]]]
+) -> Response:
+    if not RESPONSE_CACHE:
+        # ETags come from the same per-process counters, so without the cache there are none to trust either
+        rows, next_cursor = await load()
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return Response(services.encode_rows(rows), media_type="application/json", headers=headers)
+
+    # The ETag is taken before the query, so a page read during a write is cached under the older generation
+    key = f"{request.url.path}?{sorted(request.query_params.multi_items())}"
+    etag = response_cache.etag(key, tables)
+    if response_cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    cache_key = f"{key}|{etag}"
+    entry = response_cache.cache.get(cache_key)
+    if entry is None:
+        rows, next_cursor = await load()
+        headers = {"ETag": etag}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        entry = response_cache.CachedResponse(services.encode_rows(rows), headers)
+        response_cache.cache.put(cache_key, entry)
+    return Response(entry.body, media_type="application/json", headers=entry.headers)
 
 
 # API Routes
 @app.post("/v1/jobs/create", response_model=Job, tags=["Jobs 📝"], description="Create a new job 🆕")
-async def create_new_job(job: Job, session: Session = Depends(get_session)):
-    return services.create_job(job, session)
+async def create_new_job(job: Job, session: AsyncSession = Depends(get_async_session)):
+    return await async_services.create_job(job, session)
 
 
 @app.get("/v1/jobs/list", response_model=List[Job], tags=["Jobs 📝"], description="List all jobs 📋")
-async def retrieve_all_jobs(session: Session = Depends(get_session)):
-    return services.list_jobs(session)
+async def retrieve_all_jobs(
+        request: Request, cursor: Optional[str] = None, limit: int = PageSize, stream: bool = False,
+        session: AsyncSession = Depends(get_async_session)
+):
+    if stream:
+        return StreamingResponse(services.stream_ndjson(services.jobs_query(cursor)), media_type=NDJSON_MEDIA_TYPE)
+    return await cached_page(request, ["job"], lambda: async_services.list_jobs(session, cursor, limit))
 
 
 @app.post("/v1/transactions/create", response_model=Transaction, tags=["Transactions 💸"],
           description="Create a new transaction 🆕")
-async def create_new_transaction(transaction: Transaction, session: Session = Depends(get_session)):
-    return services.create_transaction(transaction, session)
+async def create_new_transaction(transaction: Transaction, session: AsyncSession = Depends(get_async_session)):
+    return await async_services.create_transaction(transaction, session)
+
+
+@app.post("/v1/transactions/bulk", response_model=BulkIngestResult, tags=["Transactions 💸"],
+          description="Create many transactions from a JSON array or NDJSON body 📦")
+async def create_transactions_in_bulk(request: Request, session: AsyncSession = Depends(get_async_session)):
+    items = services.parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    return await async_services.create_transactions_bulk(items, session)
 
 
 @app.get("/v1/transactions/list", response_model=List[Transaction], tags=["Transactions 💸"],
          description="List all transactions 📋")
-async def retrieve_all_transactions(session: Session = Depends(get_session)):
-    return services.list_transactions(session)
+async def retrieve_all_transactions(
+        request: Request, cursor: Optional[str] = None, limit: int = PageSize, stream: bool = False,
+        order_by: str = Query("id", pattern="^(id|timestamp)$"), session: AsyncSession = Depends(get_async_session)
+):
+    if stream:
+        source = await async_services.transaction_source(session, cursor, order_by)
+        return StreamingResponse(
+            services.stream_ndjson(services.transactions_query(cursor, order_by, source)), media_type=NDJSON_MEDIA_TYPE
+        )
+    return await cached_page(
+        request, ["transaction", "archivedtransaction"],
+        lambda: async_services.list_transactions(session, cursor, limit, order_by)
+    )
+
+
+@app.get("/v1/transactions/effective", response_model=List[Transaction], tags=["Transactions 💸"],
+         description="List the current version of every transaction 📗")
+async def retrieve_effective_transactions(
+        request: Request, cursor: Optional[str] = None, limit: int = PageSize, stream: bool = False,
+        order_by: str = Query("id", pattern="^(id|timestamp)$"), session: AsyncSession = Depends(get_async_session)
+):
+    if stream:
+        source = await async_services.transaction_source(session, cursor, order_by)
+        return StreamingResponse(
+            services.stream_ndjson(services.effective_transactions_query(cursor, order_by, source)),
+            media_type=NDJSON_MEDIA_TYPE
+        )
+    return await cached_page(
+        request, ["transaction", "archivedtransaction", "transactionversion"],
+        lambda: async_services.list_effective_transactions(session, cursor, limit, order_by)
+    )
+
+
+@app.get("/v1/transactions/search", response_model=List[Transaction], tags=["Transactions 💸"],
+         description="Find transactions by account, job, amount range and time window 🔎")
+async def search_transactions(
+        request: Request, account: Optional[str] = None, job_id: Optional[int] = None,
+        amount_min: Optional[float] = None, amount_max: Optional[float] = None,
+        start: Optional[datetime] = Query(None, alias="from"), end: Optional[datetime] = Query(None, alias="to"),
+        cursor: Optional[str] = None, limit: int = PageSize, stream: bool = False,
+        session: AsyncSession = Depends(get_async_session)
+):
+    if stream:
+        source = await async_services.transaction_source(session, cursor, "timestamp", start, end)
+        statement = services.search_query(account, job_id, amount_min, amount_max, start, end, cursor, source)
+        return StreamingResponse(services.stream_ndjson(statement), media_type=NDJSON_MEDIA_TYPE)
+    return await cached_page(
+        request, ["transaction", "archivedtransaction"],
+        lambda: async_services.search_transactions(
+            session, account, job_id, amount_min, amount_max, start, end, cursor, limit
+        )
+    )
+
+
+@app.get("/v1/transactions/{transaction_id}/history", response_model=TransactionHistory, tags=["Transactions 💸"],
+         description="Get every version of a transaction and its revisions 🕘")
+async def retrieve_transaction_history(transaction_id: int, session: AsyncSession = Depends(get_async_session)):
+    return await async_services.transaction_history(transaction_id, session)
 
 
 @app.post("/v1/transactions/seal", response_model=SealedManifest, tags=["Transactions 💸"],
           description="Seal all transactions 🔒")
-async def seal_all_transactions(session: Session = Depends(get_session)):
-    return services.seal_transactions(session)
+async def seal_all_transactions(session: AsyncSession = Depends(get_async_session)):
+    return await async_services.seal_transactions(session)
+
+
+@app.get("/v1/transactions/{transaction_id}/proof", response_model=InclusionProof, tags=["Transactions 💸"],
+         description="Get the Merkle inclusion proof of a sealed transaction 🧾")
+async def retrieve_transaction_proof(transaction_id: int, session: AsyncSession = Depends(get_async_session)):
+    return await async_services.transaction_proof(transaction_id, session)
+
+
+@app.get("/v1/manifests/{manifest_id}/verify", response_model=ManifestVerification, tags=["Manifests 🔒"],
+         description="Recompute and check a sealed manifest's Merkle root ✅")
+def verify_sealed_manifest(manifest_id: int, session: Session = Depends(get_session)):
+    # Sync on purpose: FastAPI runs it in the threadpool while the process pool hashes
+    return services.verify_manifest(manifest_id, session)
 
 
 @app.post("/v1/transactions/{transaction_id}/revise", response_model=Revision, tags=["Transactions 💸"],
           description="Revise a transaction ✏️")
 async def revise_existing_transaction(
-        transaction_id: int, new_transaction: Transaction, session: Session = Depends(get_session)
+        transaction_id: int, new_transaction: Transaction, session: AsyncSession = Depends(get_async_session)
 ):
-    return services.revise_transaction(transaction_id, new_transaction, session)
+    return await async_services.revise_transaction(transaction_id, new_transaction, session)
 
 
 @app.get("/v1/revisions/list", response_model=List[Revision], tags=["Revisions 📝"], description="List all revisions 📋")
-async def retrieve_all_revisions(session: Session = Depends(get_session)):
-    return services.list_revisions(session)
+async def retrieve_all_revisions(
+        request: Request, cursor: Optional[str] = None, limit: int = PageSize, stream: bool = False,
+        session: AsyncSession = Depends(get_async_session)
+):
+    if stream:
+        return StreamingResponse(
+            services.stream_ndjson(services.revisions_query(cursor)), media_type=NDJSON_MEDIA_TYPE
+        )
+    return await cached_page(
+        request, ["revision"], lambda: async_services.list_revisions(session, cursor, limit)
+    )
+
+
+@app.get("/v1/accounts/trial-balance", response_model=TrialBalance, tags=["Accounts 🏦"],
+         description="Trial balance across all accounts ⚖️")
+async def retrieve_trial_balance(
+        response: Response, cursor: Optional[str] = None, limit: int = PageSize,
+        session: AsyncSession = Depends(get_async_session)
+):
+    balance, next_cursor = await async_services.trial_balance(session, cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return balance
+
+
+@app.get("/v1/accounts/{account}/balance", response_model=AccountBalance, tags=["Accounts 🏦"],
+         description="Get an account's balance 💰")
+async def retrieve_account_balance(account: str, session: AsyncSession = Depends(get_async_session)):
+    return await async_services.get_account_balance(account, session)
+
+
+@app.get("/v1/reports/rollup", response_model=List[Rollup], tags=["Reports 📊"],
+         description="Per-bucket transaction count, sum, min and max for a job or account 📈")
+async def retrieve_rollup_report(
+        start: datetime = Query(alias="from"), end: datetime = Query(alias="to"),
+        granularity: str = Query("day", pattern="^(day|week|month)$"), job_id: Optional[int] = None,
+        account: Optional[str] = None, session: AsyncSession = Depends(get_async_session)
+):
+    return await async_services.rollup_report(session, job_id, account, start, end, granularity)
+
+
+@app.get("/v1/reports/reconciliation", response_model=ReconciliationReport, tags=["Reports 📊"],
+         description="Check balances, rollups, revision chains and manifests against the ledger 🧮")
+async def retrieve_reconciliation_report(session: AsyncSession = Depends(get_async_session)):
+    return await async_services.reconcile(session)
+
+
+@app.get("/v1/exports/transactions", tags=["Reports 📊"],
+         description="Stream every transaction in a time window as CSV, Arrow or Parquet 📦")
+async def export_transactions(
+        start: datetime = Query(alias="from"), end: datetime = Query(alias="to"),
+        format: str = Query("csv", pattern="^(csv|arrow|parquet)$")
+):
+    chosen = exports.export_format(format, start, end)
+    return StreamingResponse(
+        exports.export_stream(start, end, chosen), media_type=chosen.media_type,
+        headers={"Content-Disposition": f'attachment; filename="transactions.{chosen.suffix}"'}
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(session: AsyncSession = Depends(get_async_session)):
+    metrics.OUTBOX_DEPTH.set(await async_services.outbox_depth(session))
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000, timeout_keep_alive=120)
\ No newline at end of file
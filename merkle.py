@@ -0,0 +1,93 @@
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# Domain separation so a leaf can never be passed off as an inner node
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+
+def canonical_timestamp(timestamp: datetime) -> str:
+    # SQLite hands back naive UTC datetimes, so hash everything in that form
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp.isoformat()
+
+
+def transaction_fingerprint(row) -> bytes:
+    txn_id, job_id, account_debit, account_credit, amount, timestamp = row
+    return f"{txn_id}|{job_id}|{account_debit}|{account_credit}|{amount!r}|{canonical_timestamp(timestamp)}\n".encode()
+
+
+def leaf_hash(fingerprint: bytes) -> bytes:
+    return hashlib.sha256(LEAF_PREFIX + fingerprint).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def hash_leaves(rows: Sequence[tuple]) -> List[bytes]:
+    return [leaf_hash(transaction_fingerprint(row)) for row in rows]
+
+
+def hash_leaves_parallel(chunks: Iterable[Sequence[tuple]], workers: int) -> List[bytes]:
+    leaves = []
+    if workers <= 1:
+        for chunk in chunks:
+            leaves.extend(hash_leaves(chunk))
+        return leaves
+
+    # Keep a bounded window of chunks in flight so memory does not grow with the manifest
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(hash_leaves, chunk))
+            if len(pending) >= workers * 2:
+                leaves.extend(pending.popleft().result())
+        while pending:
+            leaves.extend(pending.popleft().result())
+    return leaves
+
+
+def build_levels(leaves: List[bytes]) -> List[List[bytes]]:
+    # An unpaired node is carried up to the next level unchanged
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(leaves: List[bytes]) -> Optional[bytes]:
+    if not leaves:
+        return None
+    return build_levels(leaves)[-1][0]
+
+
+def sibling_positions(position: int, leaf_count: int) -> List[Tuple[int, int, str]]:
+    # (level, position, side) of each sibling on the path from a leaf to the root
+    siblings = []
+    level, size = 0, leaf_count
+    while size > 1:
+        sibling = position ^ 1
+        if sibling < size:
+            siblings.append((level, sibling, "left" if sibling < position else "right"))
+        position //= 2
+        size = (size + 1) // 2
+        level += 1
+    return siblings
+
+
+def verify_proof(leaf: bytes, proof: Sequence[Tuple[str, bytes]], root: bytes) -> bool:
+    current = leaf
+    for side, sibling in proof:
+        current = node_hash(sibling, current) if side == "left" else node_hash(current, sibling)
+    return current == root
@@ -0,0 +1,274 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Label for queries run outside a request, e.g. by the outbox dispatcher
+BACKGROUND = "background"
+# Route label for requests that matched no route, so unknown paths cannot blow up the label set
+UNMATCHED = "unmatched"
+SLOW_STATEMENT_CHARS = 500
+
+REGISTRY: List["Metric"] = []
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+
+    def key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def value(self, **labels):
+        return self._values.get(self.key(labels))
+
+    def sample_lines(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {value}" for key, value in sorted(self._values.items())
+        ]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            lines = self.sample_lines()
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", *lines]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self._lock:
+            # [per-bucket counts..., +Inf count], sum
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def sample_lines(self) -> List[str]:
+        lines = []
+        bucket_names = (*self.label_names, "le")
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(bucket_names, (*key, str(bound)))} {cumulative}")
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time from request start to the last byte of the response.",
+    ("method", "route", "status"),
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled.", ("method",))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Time spent executing each SQL statement.")
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed, by the route that ran them.", ("route",))
+DB_REQUEST_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements executed per request.", ("route",), buckets=COUNT_BUCKETS
+)
+DB_REQUEST_SECONDS = Histogram("db_request_query_seconds", "Total SQL time per request.", ("route",))
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", ("pool",)
+)
+EVENT_SEND_SECONDS = Histogram("event_sink_send_duration_seconds", "Time to hand one event to the sink.", ("sink",))
+EVENT_FLUSH_SECONDS = Histogram(
+    "event_sink_flush_duration_seconds", "Time to flush a dispatched outbox batch.", ("sink",)
+)
+OUTBOX_DISPATCHED = Counter("outbox_events_dispatched_total", "Outbox events delivered to the sink.", ("sink",))
+OUTBOX_DEPTH = Gauge("outbox_depth", "Outbox events waiting to be dispatched.")
+ADMISSION_ACTIVE = Gauge("admission_requests_active", "Requests holding an admission slot.", ("route_class",))
+ADMISSION_QUEUE_SECONDS = Histogram(
+    "admission_queue_wait_seconds", "Time a request waited for an admission slot.", ("route_class",)
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests turned away by admission control.", ("route_class", "reason")
+)
+SEALS_COALESCED = Counter("seal_requests_coalesced_total", "Seal requests answered by a seal already running.")
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    query_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+    # (seconds, statement) of every query, only kept when the slow-request log is on
+    statements: Optional[List[Tuple[float, str]]] = None
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    DB_QUERY_SECONDS.observe(elapsed)
+    stats = _current_request.get()
+    if stats is None:
+        DB_QUERIES.inc(route=BACKGROUND)
+        return
+    stats.queries += 1
+    stats.query_seconds += elapsed
+    if stats.statements is not None:
+        stats.statements.append((elapsed, statement))
+
+
+def handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class TimedPoolMixin:
+    # SQLAlchemy has no event before a checkout, so the wait is timed around the pool's own get
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_POOL_WAIT_SECONDS.observe(elapsed, pool=self.pool_name)
+            stats = _current_request.get()
+            if stats is not None:
+                stats.pool_wait_seconds += elapsed
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pool_name = "sync"
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pool_name = "async"
+
+
+def route_name(scope) -> str:
+    route = scope.get("route")
+    return route.path if route is not None else UNMATCHED
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware, so the request's stats live in the same context as its endpoint
+    def __init__(self, app, slow_request_ms: float = 0):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats(statements=[] if self.slow_request_ms else None)
+        token = _current_request.set(stats)
+        method = scope["method"]
+        HTTP_IN_FLIGHT.inc(method=method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec(method=method)
+            _current_request.reset(token)
+            self.record(scope, method, status, elapsed, stats)
+
+    def record(self, scope, method: str, status: int, elapsed: float, stats: RequestStats):
+        route = route_name(scope)
+        HTTP_REQUEST_SECONDS.observe(elapsed, method=method, route=route, status=status)
+        DB_QUERIES.inc(stats.queries, route=route)
+        DB_REQUEST_QUERIES.observe(stats.queries, route=route)
+        DB_REQUEST_SECONDS.observe(stats.query_seconds, route=route)
+
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            lines = [
+                f"Slow request {method} {scope['path']} ({route}) -> {status}: {elapsed * 1000:.1f} ms, "
+                f"{stats.queries} queries in {stats.query_seconds * 1000:.1f} ms, "
+                f"pool wait {stats.pool_wait_seconds * 1000:.1f} ms"
+            ]
+            for seconds, statement in stats.statements:
+                lines.append(f"  {seconds * 1000:8.2f} ms  {' '.join(statement.split())[:SLOW_STATEMENT_CHARS]}")
+            logger.warning("\n".join(lines))
@@ -1,60 +1,306 @@
-from sqlalchemy import create_engine
-from sqlmodel import Session, select
-from models import Job, Transaction, Revision, SealedManifest
+import argparse
+import hashlib
 import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple, Type
+
+from sqlalchemy import create_engine, event, func, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import SQLModel
+
+from config import set_sqlite_pragmas
+from models import (
+    Job, Transaction, ArchivedTransaction, Revision, SealedManifest, MerkleNode, TransactionVersion, AccountBalance,
+    Rollup, OutboxEvent, MigrationCheckpoint
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def shadow_migration(old_db_engine, new_db_engine):
-    with Session(old_db_engine) as old_session, Session(new_db_engine) as new_session:
-        try:
-            # Start a transaction
-            new_session.begin()
-
-            # Fetch all records from the old database
-            old_transactions = old_session.exec(select(Transaction)).all()
-            old_jobs = old_session.exec(select(Job)).all()
-            old_revisions = old_session.exec(select(Revision)).all()
-            old_manifests = old_session.exec(select(SealedManifest)).all()
-
-            # Insert or update records in the new database
-            for job in old_jobs:
-                if not new_session.get(Job, job.id):
-                    new_session.add(job)
-                else:
-                    new_session.merge(job)
-
-            for transaction in old_transactions:
-                if not new_session.get(Transaction, transaction.id):
-                    new_session.add(transaction)
-                else:
-                    new_session.merge(transaction)
-
-            for revision in old_revisions:
-                if not new_session.get(Revision, revision.id):
-                    new_session.add(revision)
-                else:
-                    new_session.merge(revision)
-
-            for manifest in old_manifests:
-                if not new_session.get(SealedManifest, manifest.id):
-                    new_session.add(manifest)
-                else:
-                    new_session.merge(manifest)
-
-            # Commit the transaction
-            new_session.commit()
-            logger.info("Migration completed successfully.")
-        except Exception as e:
-            # Rollback in case of error
-            new_session.rollback()
-            logger.error(f"Migration failed: {e}")
-        finally:
-            new_session.close()
-
-# Example usage
-old_engine = create_engine("sqlite:///database.db")
-new_engine = create_engine("sqlite:///new_database.db")
-shadow_migration(old_engine, new_engine)
\ No newline at end of file
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_WORKERS = 4
+# Decimal places compared when checksumming non-integer numbers
+CHECKSUM_PRECISION = 6
+
+# Tables in foreign key order: each level only references tables from earlier levels,
+# so the tables within a level can be copied in parallel
+MIGRATION_LEVELS: List[List[Type[SQLModel]]] = [
+    [Job, SealedManifest, TransactionVersion, AccountBalance, Rollup, OutboxEvent],
+    [Transaction, ArchivedTransaction, MerkleNode],
+    [Revision],
+]
+
+# Tables whose rows change or move after they are written; an id high-water mark misses that, so live mode
+# compares them chunk by chunk and rewrites the chunks that differ. The projections are updated in place, and
+# archive.py moves rows between the hot and archived transaction tables under the same ids. The outbox dispatcher
+# deletes events once they are delivered, and the target must not send them again after cutover.
+MUTABLE_TABLES = {
+    TransactionVersion.__tablename__, AccountBalance.__tablename__, Rollup.__tablename__,
+    Transaction.__tablename__, ArchivedTransaction.__tablename__, OutboxEvent.__tablename__,
+}
+
+
+def dialect_insert(dialect_name: str):
+    return postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+
+
+def upsert_statement(table, dialect_name: str):
+    statement = dialect_insert(dialect_name)(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={column.name: statement.excluded[column.name] for column in table.columns if column.name != "id"},
+    )
+
+
+def load_checkpoint(connection, table_name: str) -> Tuple[int, int]:
+    checkpoints = MigrationCheckpoint.__table__
+    checkpoint = connection.execute(
+        select(checkpoints.c.last_id, checkpoints.c.rows_copied).where(checkpoints.c.table_name == table_name)
+    ).first()
+    return (checkpoint.last_id, checkpoint.rows_copied) if checkpoint else (0, 0)
+
+
+def save_checkpoint(connection, table_name: str, last_id: int, rows_copied: int):
+    checkpoints = MigrationCheckpoint.__table__
+    values = {"last_id": last_id, "rows_copied": rows_copied, "updated_at": datetime.now(timezone.utc)}
+    statement = dialect_insert(connection.dialect.name)(checkpoints).values(table_name=table_name, **values)
+    connection.execute(statement.on_conflict_do_update(index_elements=[checkpoints.c.table_name], set_=values))
+
+
+def committed_upper_id(old_db_engine, table) -> Optional[int]:
+    # Highest id at or below which every row is committed, or never will be. The checkpoint never passes it, so a
+    # row cannot commit behind the checkpoint and be skipped by every later pass.
+    with old_db_engine.begin() as old_connection:
+        if old_connection.dialect.name == "postgresql":
+            # Sequence values commit out of order; a SHARE lock waits for the transactions writing to the table,
+            # and later writers draw higher ids
+            old_connection.execute(text(f'LOCK TABLE "{table.name}" IN SHARE MODE'))
+        # SQLite's single writer numbers rows max(id) + 1 as it inserts them, so its ids commit in order
+        return old_connection.execute(select(func.max(table.c.id))).scalar()
+
+
+def copy_table(model: Type[SQLModel], old_db_engine, new_db_engine, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    table = model.__table__
+    upsert = upsert_statement(table, new_db_engine.dialect.name)
+
+    with new_db_engine.connect() as new_connection:
+        last_id, rows_copied = load_checkpoint(new_connection, table.name)
+    # Rows past the watermark are left for the next pass
+    upper_id = committed_upper_id(old_db_engine, table) or 0
+    with old_db_engine.connect() as old_connection:
+        remaining = old_connection.execute(
+            select(func.count()).select_from(table).where(table.c.id > last_id, table.c.id <= upper_id)
+        ).scalar_one()
+    logger.info(f"{table.name}: resuming after id {last_id}, {remaining} rows to copy.")
+
+    copied = 0
+    started = time.monotonic()
+    while True:
+        # Keyset over the primary key, so every chunk is an index range scan
+        with old_db_engine.connect() as old_connection:
+            rows = old_connection.execute(
+                select(table).where(table.c.id > last_id, table.c.id <= upper_id).order_by(table.c.id).limit(chunk_size)
+            ).mappings().all()
+        if not rows:
+            break
+
+        # Upsert the chunk and advance the checkpoint in the same transaction, so a rerun resumes cleanly
+        last_id = rows[-1]["id"]
+        rows_copied += len(rows)
+        with new_db_engine.begin() as new_connection:
+            new_connection.execute(upsert, [dict(row) for row in rows])
+            save_checkpoint(new_connection, table.name, last_id, rows_copied)
+
+        copied += len(rows)
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"{table.name}: {copied}/{remaining} rows ({copied / max(remaining, 1):.0%}), "
+            f"{copied / elapsed if elapsed else 0:.0f} rows/sec."
+        )
+    return copied
+
+
+def shadow_migration(old_db_engine, new_db_engine, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     workers: int = DEFAULT_WORKERS, tables: Optional[Sequence[str]] = None) -> Dict[str, int]:
+    SQLModel.metadata.create_all(new_db_engine)
+    started = time.monotonic()
+    copied = {}
+    for level in MIGRATION_LEVELS:
+        models = [model for model in level if tables is None or model.__tablename__ in tables]
+        if not models:
+            continue
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda model: copy_table(model, old_db_engine, new_db_engine, chunk_size), models)
+            copied.update({model.__tablename__: count for model, count in zip(models, results)})
+
+    total = sum(copied.values())
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Migration completed: {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/sec)."
+    )
+    return copied
+
+
+def checksum_value(value) -> bytes:
+    # One spelling per value whatever type the driver returns it as: SQLite gives naive datetimes and floats where
+    # Postgres gives aware datetimes and Decimals, and some drivers return booleans as 0 and 1. Values are length
+    # prefixed, so none can run into the next, and NULL has a marker no prefixed value can match.
+    if value is None:
+        return b"N;"
+    text = normalized_text(value).encode()
+    return b"%d:%s" % (len(text), text)
+
+
+def normalized_text(value) -> str:
+    if isinstance(value, datetime):
+        aware = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+        return aware.astimezone(timezone.utc).isoformat()
+    if isinstance(value, (bool, int)):
+        return str(int(value))
+    if isinstance(value, (float, Decimal)):
+        return f"{Decimal(str(value)):.{CHECKSUM_PRECISION}f}"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def chunk_checksum(rows) -> str:
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(b"".join(map(checksum_value, row)) + b"\n")
+    return digest.hexdigest()
+
+
+def compare_chunks(table, old_db_engine, new_db_engine, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    # Yields (low, high, source rows, target row count, match) for each source id range (low, high],
+    # ending with the open range past the last source id, where the target should have nothing
+    low = 0
+    while True:
+        with old_db_engine.connect() as old_connection:
+            rows = old_connection.execute(
+                select(table).where(table.c.id > low).order_by(table.c.id).limit(chunk_size)
+            ).all()
+        high = rows[-1].id if rows else None
+        statement = select(table).where(table.c.id > low)
+        if high is not None:
+            statement = statement.where(table.c.id <= high)
+        with new_db_engine.connect() as new_connection:
+            target_rows = new_connection.execute(statement.order_by(table.c.id)).all()
+        yield low, high, rows, len(target_rows), chunk_checksum(rows) == chunk_checksum(target_rows)
+        if high is None:
+            return
+        low = high
+
+
+def repair_table(model: Type[SQLModel], old_db_engine, new_db_engine, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    table = model.__table__
+    upsert = upsert_statement(table, new_db_engine.dialect.name)
+    repaired = 0
+    for low, high, rows, target_count, match in compare_chunks(table, old_db_engine, new_db_engine, chunk_size):
+        if match:
+            continue
+        # Replace the whole id range, which also drops rows the source has since deleted
+        statement = table.delete().where(table.c.id > low)
+        if high is not None:
+            statement = statement.where(table.c.id <= high)
+        with new_db_engine.begin() as new_connection:
+            new_connection.execute(statement)
+            if rows:
+                new_connection.execute(upsert, [dict(row._mapping) for row in rows])
+        repaired += max(len(rows), target_count)
+    return repaired
+
+
+def catch_up(old_db_engine, new_db_engine, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = DEFAULT_WORKERS,
+             max_lag: int = 0, interval: float = 1.0, max_passes: Optional[int] = None) -> int:
+    # Keep copying deltas while the old database takes writes, until a pass finds at most max_lag rows
+    passes = 0
+    while True:
+        passes += 1
+        lag = 0
+        # Level by level, so a row restored from the archive is back in the hot table before a revision of it
+        for level in MIGRATION_LEVELS:
+            append_only = [model.__tablename__ for model in level if model.__tablename__ not in MUTABLE_TABLES]
+            if append_only:
+                lag += sum(shadow_migration(old_db_engine, new_db_engine, chunk_size, workers, append_only).values())
+            for model in level:
+                if model.__tablename__ in MUTABLE_TABLES:
+                    lag += repair_table(model, old_db_engine, new_db_engine, chunk_size)
+        logger.info(f"Catch-up pass {passes}: {lag} rows behind.")
+        if lag <= max_lag or (max_passes is not None and passes >= max_passes):
+            return lag
+        time.sleep(interval)
+
+
+def verify_migration(old_db_engine, new_db_engine, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, dict]:
+    report = {}
+    for level in MIGRATION_LEVELS:
+        for model in level:
+            table = model.__table__
+            source_rows = target_rows = 0
+            mismatched = []
+            for low, high, rows, target_count, match in compare_chunks(table, old_db_engine, new_db_engine,
+                                                                       chunk_size):
+                source_rows += len(rows)
+                target_rows += target_count
+                if not match:
+                    mismatched.append((low, high))
+            report[table.name] = {
+                "source_rows": source_rows, "target_rows": target_rows, "mismatched_chunks": mismatched
+            }
+            status = "OK" if not mismatched else f"{len(mismatched)} chunks differ"
+            logger.info(f"{table.name}: {source_rows} source rows, {target_rows} target rows, {status}.")
+    return report
+
+
+def reset_checkpoints(new_db_engine, tables: Optional[Sequence[str]] = None):
+    SQLModel.metadata.create_all(new_db_engine, tables=[MigrationCheckpoint.__table__])
+    statement = MigrationCheckpoint.__table__.delete()
+    if tables:
+        statement = statement.where(MigrationCheckpoint.__table__.c.table_name.in_(tables))
+    with new_db_engine.begin() as connection:
+        connection.execute(statement)
+
+
+def migration_engine(url: str, pool_size: int):
+    engine = create_engine(url, pool_size=pool_size, max_overflow=0)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the ledger from one database to another in resumable chunks.")
+    parser.add_argument("--source", default="sqlite:///database.db", help="URL of the database to copy from.")
+    parser.add_argument("--target", default="sqlite:///new_database.db", help="URL of the database to copy into.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk and commit.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Tables copied in parallel.")
+    parser.add_argument("--tables", nargs="*", help="Only copy these tables.")
+    parser.add_argument("--reset", action="store_true", help="Forget checkpoints and copy from the start.")
+    parser.add_argument("--live", action="store_true",
+                        help="After the copy, keep catching up with writes to the source until the lag is small.")
+    parser.add_argument("--max-lag", type=int, default=0, help="Rows behind at which live mode stops.")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between catch-up passes.")
+    parser.add_argument("--verify", action="store_true", help="Compare row counts and chunk checksums at the end.")
+    args = parser.parse_args()
+
+    old_engine = migration_engine(args.source, args.workers)
+    new_engine = migration_engine(args.target, args.workers)
+    if args.reset:
+        reset_checkpoints(new_engine, args.tables)
+    shadow_migration(old_engine, new_engine, args.chunk_size, args.workers, args.tables)
+    if args.live:
+        catch_up(old_engine, new_engine, args.chunk_size, args.workers, args.max_lag, args.interval)
+    if args.verify:
+        report = verify_migration(old_engine, new_engine, args.chunk_size)
+        if any(table["mismatched_chunks"] for table in report.values()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,28 @@ class Transaction(SQLModel, table=True):
     __table_args__ = (
         Index("idx_transaction_job_id", "job_id"),
         Index("idx_transaction_timestamp", "timestamp"),
+        Index("idx_transaction_job_id_timestamp", "job_id", "timestamp"),
+        Index("idx_transaction_account_debit_timestamp", "account_debit", "timestamp"),
+        Index("idx_transaction_account_credit_timestamp", "account_credit", "timestamp"),
+        Index("idx_transaction_amount", "amount"),
+    )
+
+class ArchivedTransaction(SQLModel, table=True):
+    # Sealed transactions moved out of the hot table by archive.py, under their original ids
+    id: int = Field(primary_key=True)
+    job_id: int = Field(foreign_key="job.id")
+    account_debit: str
+    account_credit: str
+    amount: float
+    timestamp: datetime
+
+    __table_args__ = (
+        Index("idx_archived_transaction_job_id", "job_id"),
+        Index("idx_archived_transaction_timestamp", "timestamp"),
+        Index("idx_archived_transaction_job_id_timestamp", "job_id", "timestamp"),
+        Index("idx_archived_transaction_account_debit_timestamp", "account_debit", "timestamp"),
+        Index("idx_archived_transaction_account_credit_timestamp", "account_credit", "timestamp"),
+        Index("idx_archived_transaction_amount", "amount"),
     )
 
 class Revision(SQLModel, table=True):
@@ -42,12 +64,161 @@ class Revision(SQLModel, table=True):
         Index("idx_revision_corrected_transaction_id", "corrected_transaction_id"),
     )
 
+class TransactionVersion(SQLModel, table=True):
+    id: int = Field(primary_key=True)
+    transaction_id: int
+    root_transaction_id: int
+    effective_transaction_id: int
+    superseded: bool = False
+
+    __table_args__ = (
+        Index("idx_transaction_version_transaction_id", "transaction_id", unique=True),
+        Index("idx_transaction_version_root_transaction_id", "root_transaction_id"),
+    )
+
+
 class SealedManifest(SQLModel, table=True):
     id: int = Field(primary_key=True)
     sealed_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     transaction_count: int
     checksum: str
+    merkle_root: str
+    previous_checksum: Optional[str] = None
+    first_transaction_id: int
+    last_transaction_id: int
+    first_timestamp: datetime
+    last_timestamp: datetime
 
     __table_args__ = (
         Index("idx_sealed_manifest_sealed_at", "sealed_at"),
+        # Two seals chained from the same predecessor start at the same row; the second fails instead of forking
+        Index("idx_sealed_manifest_first_transaction_id", "first_transaction_id", unique=True),
+    )
+
+
+class MerkleNode(SQLModel, table=True):
+    id: int = Field(primary_key=True)
+    manifest_id: int = Field(foreign_key="sealedmanifest.id")
+    level: int
+    position: int
+    hash: bytes
+    transaction_id: Optional[int] = None
+
+    __table_args__ = (
+        Index("idx_merkle_node_position", "manifest_id", "level", "position", unique=True),
+        Index("idx_merkle_node_transaction_id", "transaction_id"),
+    )
+
+
+class OutboxEvent(SQLModel, table=True):
+    id: int = Field(primary_key=True)
+    topic: str
+    payload: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class AccountBalance(SQLModel, table=True):
+    id: int = Field(primary_key=True)
+    account: str
+    debit_total: float = 0.0
+    credit_total: float = 0.0
+    balance: float = 0.0
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("idx_account_balance_account", "account", unique=True),
     )
+
+
+class Rollup(SQLModel, table=True):
+    id: int = Field(primary_key=True)
+    dimension: str
+    key: str
+    granularity: str
+    bucket_start: datetime
+    transaction_count: int = 0
+    amount_total: float = 0.0
+    amount_min: float
+    amount_max: float
+
+    __table_args__ = (
+        Index("idx_rollup_bucket", "dimension", "key", "granularity", "bucket_start", unique=True),
+    )
+
+
+class MigrationCheckpoint(SQLModel, table=True):
+    id: int = Field(primary_key=True)
+    table_name: str
+    last_id: int = 0
+    rows_copied: int = 0
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("idx_migration_checkpoint_table_name", "table_name", unique=True),
+    )
+
+
+class ProofStep(SQLModel):
+    side: str
+    hash: str
+
+
+class InclusionProof(SQLModel):
+    transaction_id: int
+    manifest_id: int
+    leaf_hash: str
+    merkle_root: str
+    proof: List[ProofStep]
+
+
+class ManifestVerification(SQLModel):
+    manifest_id: int
+    transaction_count: int
+    verified_count: int
+    merkle_root: str
+    computed_root: Optional[str] = None
+    valid: bool
+
+
+class BulkItemResult(SQLModel):
+    index: int
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BulkIngestResult(SQLModel):
+    created: int
+    failed: int
+    results: List[BulkItemResult]
+
+
+class TrialBalance(SQLModel):
+    total_debits: float
+    total_credits: float
+    balanced: bool
+    accounts: List[AccountBalance]
+
+
+class Discrepancy(SQLModel):
+    check: str
+    key: str
+    expected: Optional[float] = None
+    actual: Optional[float] = None
+
+
+class ReconciliationReport(SQLModel):
+    transactions: int
+    amount_total: float
+    accounts: int
+    manifests: int
+    # Whether the account balances net to zero, as every debit has a matching credit
+    balanced: bool
+    discrepancy_count: int
+    discrepancies: List[Discrepancy]
+
+
+class TransactionHistory(SQLModel):
+    transaction_id: int
+    effective_transaction_id: int
+    versions: List[Transaction]
+    revisions: List[Revision]
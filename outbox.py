@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+from sqlmodel import Session, delete, select
+
+from config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_BACKOFF, OUTBOX_FLUSH_TIMEOUT
+from models import OutboxEvent
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxDispatcher:
+    def __init__(self, event_sink, engine, batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.event_sink = event_sink
+        self.engine = engine
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def dispatch_once(self) -> int:
+        with Session(self.engine) as session:
+            events = session.exec(select(OutboxEvent).order_by(OutboxEvent.id).limit(self.batch_size)).all()
+            if not events:
+                return 0
+
+            # Hand the whole batch to the sink, then wait for it once
+            sink = type(self.event_sink).__name__
+            futures = []
+            for event in events:
+                started = time.perf_counter()
+                futures.append(self.event_sink.send(event.topic, event.payload.encode("utf-8")))
+                metrics.EVENT_SEND_SECONDS.observe(time.perf_counter() - started, sink=sink)
+            started = time.perf_counter()
+            self.event_sink.flush(timeout=OUTBOX_FLUSH_TIMEOUT)
+            metrics.EVENT_FLUSH_SECONDS.observe(time.perf_counter() - started, sink=sink)
+
+            # Only delete what the sink acknowledged; the rest is retried on the next pass
+            delivered = [event.id for event, future in zip(events, futures) if future.succeeded()]
+            if delivered:
+                session.exec(delete(OutboxEvent).where(OutboxEvent.id.in_(delivered)))
+                session.commit()
+                metrics.OUTBOX_DISPATCHED.inc(len(delivered), sink=sink)
+            if len(delivered) < len(events):
+                logger.warning(f"Outbox dispatch left {len(events) - len(delivered)} events undelivered.")
+            return len(delivered)
+
+    def run(self):
+        failures = 0
+        while not self._stopped.is_set():
+            try:
+                delivered = self.dispatch_once()
+                failures = 0
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}")
+                delivered = 0
+                failures += 1
+
+            # Keep draining while batches come back full, otherwise back off
+            if delivered < self.batch_size:
+                self._stopped.wait(min(self.poll_interval * 2 ** failures, OUTBOX_MAX_BACKOFF))
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
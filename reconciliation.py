@@ -0,0 +1,175 @@
+import logging
+import sys
+from typing import Dict, List, Optional
+
+from sqlalchemy import Integer, and_, cast, func
+from sqlmodel import Session, select
+
+import archive
+from models import (
+    Job, Transaction, TransactionVersion, AccountBalance, Rollup, SealedManifest, MerkleNode, Discrepancy,
+    ReconciliationReport
+)
+from revision_index import not_superseded
+
+logger = logging.getLogger(__name__)
+
+# Amounts are compared in integer cents, so float rounding in the projections never counts as drift
+MINOR_UNITS = 100
+MAX_DISCREPANCIES = 1000
+ROLLUP_GRANULARITY = "month"
+
+
+def minor_units(column):
+    return cast(func.round(column * MINOR_UNITS), Integer)
+
+
+def to_minor(amount: float) -> int:
+    return round(amount * MINOR_UNITS)
+
+
+def from_minor(amount: Optional[int]) -> Optional[float]:
+    return None if amount is None else amount / MINOR_UNITS
+
+
+def grouped(session: Session, key, reduction, *where) -> Dict:
+    # One grouped reduction in the database instead of a pass over the rows in Python
+    statement = select(key, reduction).where(*where).group_by(key)
+    return {group: int(total or 0) for group, total in session.exec(statement)}
+
+
+def compare(check: str, expected: Dict, actual: Dict, scale=from_minor) -> List[Discrepancy]:
+    # A key missing on one side counts as zero there, but is reported as None
+    return [
+        Discrepancy(check=check, key=str(key), expected=scale(expected.get(key)), actual=scale(actual.get(key)))
+        for key in sorted(expected.keys() | actual.keys(), key=str)
+        if expected.get(key, 0) != actual.get(key, 0)
+    ]
+
+
+def account_discrepancies(session: Session, source=Transaction) -> List[Discrepancy]:
+    effective = not_superseded(source)
+    amount = func.sum(minor_units(source.amount))
+    debits = grouped(session, source.account_debit, amount, effective)
+    credits = grouped(session, source.account_credit, amount, effective)
+    recorded = session.exec(
+        select(AccountBalance.account, AccountBalance.debit_total, AccountBalance.credit_total)
+    ).all()
+    return [
+        *compare("account_debits", debits, {account: to_minor(debit) for account, debit, _ in recorded}),
+        *compare("account_credits", credits, {account: to_minor(credit) for account, _, credit in recorded}),
+    ]
+
+
+def job_discrepancies(session: Session, source=Transaction) -> List[Discrepancy]:
+    effective = not_superseded(source)
+    job_key = cast(source.job_id, Rollup.key.type)
+    in_rollups = and_(Rollup.dimension == "job", Rollup.granularity == ROLLUP_GRANULARITY)
+    return [
+        *compare("job_totals", grouped(session, job_key, func.sum(minor_units(source.amount)), effective),
+                 grouped(session, Rollup.key, func.sum(minor_units(Rollup.amount_total)), in_rollups)),
+        *compare("job_counts", grouped(session, job_key, func.count(source.id), effective),
+                 grouped(session, Rollup.key, func.sum(Rollup.transaction_count), in_rollups),
+                 scale=lambda count: count),
+    ]
+
+
+def missing_job_discrepancies(session: Session, source=Transaction) -> List[Discrepancy]:
+    statement = (
+        select(source.job_id, func.count(source.id))
+        .outerjoin(Job, Job.id == source.job_id)
+        .where(Job.id.is_(None))
+        .group_by(source.job_id)
+    )
+    return [
+        Discrepancy(check="missing_job", key=str(job_id), expected=0, actual=count)
+        for job_id, count in session.exec(statement)
+    ]
+
+
+def revision_discrepancies(session: Session) -> List[Discrepancy]:
+    # Every revision chain has exactly one effective version, or its amounts count twice or not at all
+    current = func.sum(cast(~TransactionVersion.superseded, Integer))
+    statement = (
+        select(TransactionVersion.root_transaction_id, current)
+        .group_by(TransactionVersion.root_transaction_id)
+        .having(current != 1)
+    )
+    return [
+        Discrepancy(check="revision_chain", key=str(root_id), expected=1, actual=count)
+        for root_id, count in session.exec(statement)
+    ]
+
+
+def manifest_discrepancies(session: Session, source=Transaction) -> List[Discrepancy]:
+    covered = (
+        select(func.count(source.id))
+        .where(source.id.between(SealedManifest.first_transaction_id, SealedManifest.last_transaction_id))
+        .scalar_subquery()
+    )
+    leaves = (
+        select(func.count(MerkleNode.id))
+        .where(MerkleNode.manifest_id == SealedManifest.id, MerkleNode.level == 0)
+        .scalar_subquery()
+    )
+    discrepancies = []
+    for manifest_id, expected, rows, leaf_count in session.exec(
+        select(SealedManifest.id, SealedManifest.transaction_count, covered, leaves).order_by(SealedManifest.id)
+    ):
+        if rows != expected:
+            discrepancies.append(
+                Discrepancy(check="manifest_rows", key=str(manifest_id), expected=expected, actual=rows)
+            )
+        if leaf_count != expected:
+            discrepancies.append(
+                Discrepancy(check="manifest_leaves", key=str(manifest_id), expected=expected, actual=leaf_count)
+            )
+    return discrepancies
+
+
+def reconcile(session: Session, max_discrepancies: int = MAX_DISCREPANCIES) -> ReconciliationReport:
+    # Archived transactions still count towards every projection
+    source = archive.transaction_source(session)
+    transactions, total = session.exec(
+        select(func.count(source.id), func.sum(minor_units(source.amount))).where(not_superseded(source))
+    ).one()
+    # Each transaction debits and credits the same amount, so only the projection can drift from zero
+    recorded_net = session.exec(
+        select(func.sum(minor_units(AccountBalance.debit_total) - minor_units(AccountBalance.credit_total)))
+    ).one() or 0
+
+    discrepancies = [
+        *account_discrepancies(session, source),
+        *job_discrepancies(session, source),
+        *missing_job_discrepancies(session, source),
+        *revision_discrepancies(session),
+        *manifest_discrepancies(session, source),
+    ]
+    if recorded_net:
+        discrepancies.append(
+            Discrepancy(check="ledger_net", key="accounts", expected=0, actual=from_minor(recorded_net))
+        )
+
+    return ReconciliationReport(
+        transactions=transactions,
+        amount_total=from_minor(total or 0),
+        accounts=session.exec(select(func.count(AccountBalance.id))).one(),
+        manifests=session.exec(select(func.count(SealedManifest.id))).one(),
+        balanced=not recorded_net,
+        discrepancy_count=len(discrepancies),
+        discrepancies=discrepancies[:max_discrepancies],
+    )
+
+
+if __name__ == "__main__":
+    from config import engine
+
+    logging.basicConfig(level=logging.INFO)
+    with Session(engine) as reconcile_session:
+        report = reconcile(reconcile_session)
+    for discrepancy in report.discrepancies:
+        logger.error(f"{discrepancy.check} {discrepancy.key}: expected {discrepancy.expected}, "
+                     f"got {discrepancy.actual}")
+    logger.info(f"Checked {report.transactions} transactions, {report.accounts} accounts and {report.manifests} "
+                f"manifests: {report.discrepancy_count} discrepancies.")
+    sys.exit(1 if report.discrepancy_count else 0)
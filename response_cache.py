@@ -0,0 +1,113 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_ENTRIES
+
+# Changes on every restart, so an ETag from before a restart never matches restarted counters
+EPOCH = uuid.uuid4().hex[:8]
+
+_generations: Dict[str, int] = {}
+_generations_lock = threading.Lock()
+
+
+def generation(tables: Sequence[str]) -> Tuple[int, ...]:
+    return tuple(_generations.get(table, 0) for table in tables)
+
+
+def bump(tables: Iterable[str]):
+    with _generations_lock:
+        for table in tables:
+            _generations[table] = _generations.get(table, 0) + 1
+
+
+def etag(key: str, tables: Sequence[str]) -> str:
+    digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    return f'"{EPOCH}-{"-".join(map(str, generation(tables)))}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], current: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(tag.strip().removeprefix("W/") in (current, "*") for tag in if_none_match.split(","))
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    headers: Dict[str, str]
+
+
+class ResponseCache:
+    # LRU of serialized responses, bounded by entry count and total body size
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.body)
+            self._entries[key] = entry
+            self.size += len(entry.body)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+cache = ResponseCache()
+
+
+# Every session records the tables it writes and bumps their generations once the commit has landed.
+# Bumping any earlier would let a concurrent read cache pre-commit rows under the new generation.
+
+
+@event.listens_for(Session, "after_flush")
+def track_flushed_tables(session, flush_context):
+    written = session.info.setdefault("written_tables", set())
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        written.add(type(instance).__table__.name)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def track_executed_tables(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = orm_execute_state.statement.table
+        orm_execute_state.session.info.setdefault("written_tables", set()).add(table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def bump_committed_tables(session):
+    bump(session.info.pop("written_tables", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_rolled_back_tables(session):
+    session.info.pop("written_tables", None)
@@ -0,0 +1,71 @@
+import logging
+
+from sqlalchemy import exists, update
+from sqlmodel import Session, delete, select
+
+from models import Transaction, Revision, TransactionVersion
+
+logger = logging.getLogger(__name__)
+
+
+def not_superseded(source=Transaction):
+    # Transactions without a version row were never revised and are their own effective version
+    return ~exists().where(TransactionVersion.transaction_id == source.id, TransactionVersion.superseded)
+
+
+def effective_transaction_id(transaction_id: int, session: Session) -> int:
+    version = session.exec(select(TransactionVersion).where(TransactionVersion.transaction_id == transaction_id)).first()
+    return version.effective_transaction_id if version else transaction_id
+
+
+def record_revision(original_transaction_id: int, corrected_transaction_id: int, session: Session) -> int:
+    # Returns the version the correction replaces, which is not the original if it was already revised
+    original = session.exec(
+        select(TransactionVersion).where(TransactionVersion.transaction_id == original_transaction_id)
+    ).first()
+    if original is None:
+        root_transaction_id = previous_effective_id = original_transaction_id
+        session.add(TransactionVersion(
+            transaction_id=original_transaction_id,
+            root_transaction_id=root_transaction_id,
+            effective_transaction_id=corrected_transaction_id,
+            superseded=True,
+        ))
+    else:
+        # Path compression: every version in the chain points straight at the new effective one
+        root_transaction_id = original.root_transaction_id
+        previous_effective_id = original.effective_transaction_id
+        session.exec(
+            update(TransactionVersion)
+            .where(TransactionVersion.root_transaction_id == root_transaction_id)
+            .values(effective_transaction_id=corrected_transaction_id, superseded=True)
+        )
+    session.add(TransactionVersion(
+        transaction_id=corrected_transaction_id,
+        root_transaction_id=root_transaction_id,
+        effective_transaction_id=corrected_transaction_id,
+        superseded=False,
+    ))
+    session.flush()
+    return previous_effective_id
+
+
+def rebuild(session: Session) -> int:
+    # Replay every revision in order to build the index for an existing ledger
+    session.exec(delete(TransactionVersion))
+    revisions = session.exec(
+        select(Revision.original_transaction_id, Revision.corrected_transaction_id).order_by(Revision.id)
+    ).all()
+    for original_transaction_id, corrected_transaction_id in revisions:
+        record_revision(original_transaction_id, corrected_transaction_id, session)
+    session.commit()
+    logger.info(f"Indexed {len(revisions)} revisions.")
+    return len(revisions)
+
+
+if __name__ == "__main__":
+    from config import engine
+
+    logging.basicConfig(level=logging.INFO)
+    with Session(engine) as rebuild_session:
+        rebuild(rebuild_session)
@@ -0,0 +1,184 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, delete, select
+
+import archive
+from models import Transaction, Rollup
+from revision_index import not_superseded
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("day", "week", "month")
+
+# Rollup dimension -> Transaction column it groups by
+DIMENSIONS = {
+    "job": Transaction.job_id,
+    "account_debit": Transaction.account_debit,
+    "account_credit": Transaction.account_credit,
+}
+
+BACKFILL_CHUNK_SIZE = 10000
+
+# (dimension, key, granularity, bucket_start) -> [count, total, min, max]
+Buckets = Dict[Tuple[str, str, str, datetime], List[float]]
+
+
+def as_utc(timestamp: datetime) -> datetime:
+    # Naive timestamps are UTC, as SQLite stores them without an offset
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    day = as_utc(timestamp).replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def bucket_end(start: datetime, granularity: str) -> datetime:
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def bucket_keys(job_id: int, account_debit: str, account_credit: str, timestamp: datetime):
+    keys = {"job": str(job_id), "account_debit": account_debit, "account_credit": account_credit}
+    for granularity in GRANULARITIES:
+        start = bucket_start(timestamp, granularity)
+        for dimension, key in keys.items():
+            yield dimension, key, granularity, start
+
+
+def add_to_buckets(buckets: Buckets, job_id: int, account_debit: str, account_credit: str, amount: float,
+                   timestamp: datetime):
+    for bucket in bucket_keys(job_id, account_debit, account_credit, timestamp):
+        stats = buckets.get(bucket)
+        if stats is None:
+            buckets[bucket] = [1, amount, amount, amount]
+        else:
+            stats[0] += 1
+            stats[1] += amount
+            stats[2] = min(stats[2], amount)
+            stats[3] = max(stats[3], amount)
+
+
+def bucket_rows(buckets: Buckets) -> List[dict]:
+    # Sorted so concurrent writers take row locks in the same order
+    return [
+        {
+            "dimension": dimension,
+            "key": key,
+            "granularity": granularity,
+            "bucket_start": start,
+            "transaction_count": count,
+            "amount_total": total,
+            "amount_min": amount_min,
+            "amount_max": amount_max,
+        }
+        for (dimension, key, granularity, start), (count, total, amount_min, amount_max) in sorted(buckets.items())
+    ]
+
+
+def merge_buckets(buckets: Buckets, session: Session):
+    if not buckets:
+        return
+    postgres = session.get_bind().dialect.name == "postgresql"
+    dialect_insert = postgresql.insert if postgres else sqlite.insert
+    # SQLite's two-argument min/max are scalar; Postgres spells them least/greatest
+    least = func.least if postgres else func.min
+    greatest = func.greatest if postgres else func.max
+    table = Rollup.__table__
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.dimension, table.c.key, table.c.granularity, table.c.bucket_start],
+        set_={
+            "transaction_count": table.c.transaction_count + statement.excluded.transaction_count,
+            "amount_total": table.c.amount_total + statement.excluded.amount_total,
+            "amount_min": least(table.c.amount_min, statement.excluded.amount_min),
+            "amount_max": greatest(table.c.amount_max, statement.excluded.amount_max),
+        },
+    )
+    # Built on the table rather than the model, so it skips the ORM bulk insert bookkeeping
+    session.execute(statement, bucket_rows(buckets))
+
+
+def record_transactions(transactions: Iterable[Tuple[int, str, str, float, datetime]], session: Session):
+    buckets = {}
+    for job_id, account_debit, account_credit, amount, timestamp in transactions:
+        add_to_buckets(buckets, job_id, account_debit, account_credit, amount, timestamp)
+    merge_buckets(buckets, session)
+
+
+def effective_transactions(source=Transaction):
+    return select(
+        source.job_id, source.account_debit, source.account_credit, source.amount, source.timestamp
+    ).where(not_superseded(source))
+
+
+def recompute_buckets(bucket_set: Iterable[Tuple[str, str, str, datetime]], session: Session, source=Transaction):
+    # min/max cannot be decremented, so buckets touched by a revision are rebuilt from source
+    for dimension, key, granularity, start in sorted(set(bucket_set)):
+        column = getattr(source, DIMENSIONS[dimension].key)
+        count, total, amount_min, amount_max = session.exec(
+            select(func.count(source.id), func.sum(source.amount), func.min(source.amount), func.max(source.amount))
+            .where(
+                not_superseded(source),
+                column == (int(key) if dimension == "job" else key),
+                source.timestamp >= start,
+                source.timestamp < bucket_end(start, granularity),
+            )
+        ).one()
+        session.exec(delete(Rollup).where(
+            Rollup.dimension == dimension, Rollup.key == key, Rollup.granularity == granularity,
+            Rollup.bucket_start == start,
+        ))
+        if count:
+            merge_buckets({(dimension, key, granularity, start): [count, total, amount_min, amount_max]}, session)
+
+
+def rollup_buckets(session: Session, dimension: str, key: str, granularity: str, start: datetime,
+                   end: datetime) -> Sequence[Rollup]:
+    statement = (
+        select(Rollup)
+        .where(
+            Rollup.dimension == dimension,
+            Rollup.key == key,
+            Rollup.granularity == granularity,
+            Rollup.bucket_start >= bucket_start(start, granularity),
+            Rollup.bucket_start <= as_utc(end),
+        )
+        .order_by(Rollup.bucket_start)
+    )
+    return session.exec(statement).all()
+
+
+def backfill(session: Session):
+    # Rebuild every rollup from the effective ledger, merging one chunk at a time
+    session.exec(delete(Rollup))
+    source = archive.transaction_source(session)
+    statement = effective_transactions(source).order_by(source.id).execution_options(yield_per=BACKFILL_CHUNK_SIZE)
+    total = 0
+    for rows in session.exec(statement).partitions():
+        record_transactions(rows, session)
+        total += len(rows)
+        logger.info(f"Rolled up {total} transactions.")
+    session.commit()
+    return total
+
+
+if __name__ == "__main__":
+    from config import engine
+
+    logging.basicConfig(level=logging.INFO)
+    with Session(engine) as backfill_session:
+        backfill(backfill_session)
@@ -0,0 +1,94 @@
+import argparse
+import importlib.util
+import logging
+import math
+import os
+from typing import Dict, Mapping
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+# Single-process pool sizes in config.py, shared out between the workers
+TOTAL_POOL_SIZE = 50
+TOTAL_MAX_OVERFLOW = 100
+GRACEFUL_SHUTDOWN_SECONDS = 30
+KEEP_ALIVE_SECONDS = 120
+
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+
+def worker_environment(workers: int, environ: Mapping[str, str]) -> Dict[str, str]:
+    # Settings the workers inherit; anything already set in the environment wins
+    if workers <= 1:
+        return {}
+    defaults = {
+        "DB_POOL_SIZE": str(math.ceil(TOTAL_POOL_SIZE / workers)),
+        "DB_MAX_OVERFLOW": str(math.ceil(TOTAL_MAX_OVERFLOW / workers)),
+        # The launcher runs the only dispatcher, so events are not sent once per worker
+        "OUTBOX_DISPATCHER": "false",
+    }
+    return {name: value for name, value in defaults.items() if name not in environ}
+
+
+def optional_implementation(requested: str, module: str, fallback: str) -> str:
+    if requested != "auto":
+        return requested
+    return module if importlib.util.find_spec(module) else fallback
+
+
+def serve(host: str, port: int, workers: int, loop: str = "auto", http: str = "auto",
+          graceful_timeout: int = GRACEFUL_SHUTDOWN_SECONDS):
+    os.environ.update(worker_environment(workers, os.environ))
+    loop = optional_implementation(loop, "uvloop", "asyncio")
+    http = optional_implementation(http, "httptools", "h11")
+    logger.info(f"Starting {workers} workers on {host}:{port} with the {loop} loop and {http} parser.")
+
+    # Imported after the environment is set, as config reads it at import
+    from config import OUTBOX_FLUSH_TIMEOUT, engine
+    from dependencies import create_schema
+    from event_sinks import create_event_sink
+    from outbox import OutboxDispatcher
+
+    dispatcher = event_sink = None
+    if workers > 1:
+        # Once here rather than in every worker's lifespan at the same moment
+        create_schema()
+        event_sink = create_event_sink()
+        dispatcher = OutboxDispatcher(event_sink, engine)
+        dispatcher.start()
+
+    try:
+        # Workers are spawned rather than forked and import the app themselves, so each one builds its own engines
+        # and event sink in its lifespan. On SIGTERM or SIGINT they stop accepting connections and finish in-flight
+        # requests for up to graceful_timeout seconds.
+        uvicorn.run("main:app", host=host, port=port, workers=workers, loop=loop, http=http,
+                    timeout_keep_alive=KEEP_ALIVE_SECONDS, timeout_graceful_shutdown=graceful_timeout)
+    finally:
+        if dispatcher:
+            dispatcher.stop()
+            event_sink.flush(timeout=OUTBOX_FLUSH_TIMEOUT)
+            event_sink.close(timeout=OUTBOX_FLUSH_TIMEOUT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API in several worker processes.")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to bind.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind.")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Worker processes; defaults to WEB_CONCURRENCY or the CPU count.")
+    parser.add_argument("--loop", choices=("auto", "asyncio", "uvloop"), default="auto",
+                        help="Event loop; auto uses uvloop when it is installed.")
+    parser.add_argument("--http", choices=("auto", "h11", "httptools"), default="auto",
+                        help="HTTP parser; auto uses httptools when it is installed.")
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_SHUTDOWN_SECONDS,
+                        help="Seconds to let in-flight requests finish on shutdown.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.host, args.port, args.workers, args.loop, args.http, args.graceful_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,95 +1,687 @@
+import base64
 import hashlib
 import json
 from datetime import datetime, timezone
-from typing import Sequence
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
+import orjson
 from fastapi import HTTPException
-from kafka import KafkaProducer
-from sqlmodel import select, Session
+from sqlalchemy import Row, func, insert, inspect, text, tuple_, union
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import delete, select, Session
 
-from models import Job, Transaction, Revision, SealedManifest
-
-# Initialize Kafka Producer
-producer = KafkaProducer(
-    bootstrap_servers="localhost:9092",
-    value_serializer=lambda v: json.dumps(v).encode("utf-8")
+import archive
+import merkle
+import revision_index
+import rollups
+from config import engine, VERIFY_WORKERS
+from models import (
+    Job, Transaction, Revision, SealedManifest, MerkleNode, OutboxEvent, InclusionProof, ProofStep, ManifestVerification,
+    BulkItemResult, BulkIngestResult, AccountBalance, TrialBalance, Rollup, TransactionVersion, TransactionHistory
 )
 
+# Pagination settings for the list endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Datetimes come out as "...Z", matching what the Pydantic models produce
+JSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC
 
-def create_job(job: Job, session: Session) -> Job:
+# Bulk ingest settings
+BULK_MAX_ITEMS = 10000
+INVALID_JSON = object()
+VERIFY_CHUNK_SIZE = 10000
+
+
+def encode_cursor(*values) -> str:
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> List:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    # Every cursor ends with the row id that breaks ties
+    if not isinstance(values, list) or len(values) != size or not isinstance(values[-1], int):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return values
+
+
+def paginate(session: Session, statement, limit: int, key) -> Tuple[Sequence, Optional[str]]:
+    # Fetch one extra row to find out whether another page follows
+    rows = session.exec(statement.limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def table_columns(model):
+    # List queries select plain columns: rows come back as tuples, and DB output needs no model validation.
+    # Works on aliases such as archive.LEDGER too, which select from their own subquery.
+    return select(*inspect(model).selectable.columns)
+
+
+def encode_rows(rows: Sequence[Row]) -> bytes:
+    return orjson.dumps([row._asdict() for row in rows], option=JSON_OPTIONS)
+
+
+def stream_ndjson(statement) -> Iterator[bytes]:
+    # Runs after the request session is gone, so it owns its session
+    with Session(engine) as session:
+        result = session.exec(statement.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        for rows in result.partitions():
+            yield b"".join(orjson.dumps(row._asdict(), option=JSON_OPTIONS) + b"\n" for row in rows)
+
+
+# The add_* functions stage a write and flush it without committing, so callers can
+# commit one write on its own or group several into a single transaction
+
+
+def add_job(job: Job, session: Session) -> Job:
     session.add(job)
+    session.flush()
+    return job
+
+
+def create_job(job: Job, session: Session) -> Job:
+    add_job(job, session)
     session.commit()
     session.refresh(job)
     return job
 
 
-def list_jobs(session: Session) -> Sequence[Job]:
-    return session.exec(select(Job)).all()
+def jobs_query(cursor: Optional[str] = None):
+    statement = table_columns(Job).order_by(Job.id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        statement = statement.where(Job.id > last_id)
+    return statement
 
 
-def create_transaction(transaction: Transaction, session: Session) -> Transaction:
+def list_jobs(
+        session: Session, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[Sequence[Row], Optional[str]]:
+    return paginate(session, jobs_query(cursor), limit, lambda job: (job.id,))
+
+
+def transaction_error(account_debit, account_credit, amount) -> Optional[str]:
     # Validate debit and credit accounts
-    if not transaction.account_debit or not transaction.account_credit:
-        raise HTTPException(status_code=400, detail="Both debit and credit accounts are required.")
-    if transaction.amount <= 0:
-        raise HTTPException(status_code=400, detail="Transaction amount must be positive.")
+    if not account_debit or not account_credit:
+        return "Both debit and credit accounts are required."
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool):
+        return "Transaction amount must be a number."
+    if amount <= 0:
+        return "Transaction amount must be positive."
+    return None
+
+
+def parse_timestamp(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(value)
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def transaction_event(transaction_data: dict) -> dict:
+    return {"topic": "transactions", "payload": orjson.dumps(transaction_data).decode()}
+
+
+def validate_transaction(transaction: Transaction):
+    # Table models skip Pydantic validation, so a request body is checked here before it reaches the projections
+    error = transaction_error(transaction.account_debit, transaction.account_credit, transaction.amount)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
 
     # Ensure timestamp is a datetime object
-    if isinstance(transaction.timestamp, str):
-        try:
-            transaction.timestamp = datetime.fromisoformat(transaction.timestamp.replace("Z", "+00:00"))
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid timestamp format.")
+    try:
+        transaction.timestamp = parse_timestamp(transaction.timestamp)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid timestamp format.")
 
+
+def add_transaction(transaction: Transaction, session: Session) -> Transaction:
+    validate_transaction(transaction)
     session.add(transaction)
+    session.flush()
+
+    # Keep the account balance projection in step within the same DB transaction
+    deltas = {}
+    add_balance_delta(deltas, transaction.account_debit, transaction.account_credit, transaction.amount)
+    apply_balance_deltas(deltas, session)
+    rollups.record_transactions([(
+        transaction.job_id, transaction.account_debit, transaction.account_credit, transaction.amount,
+        transaction.timestamp
+    )], session)
+
+    # Queue the Kafka event in the same DB transaction; the outbox dispatcher publishes it
+    session.add(OutboxEvent(**transaction_event(transaction.model_dump())))
+    session.flush()
+    return transaction
+
+
+def create_transaction(transaction: Transaction, session: Session) -> Transaction:
+    add_transaction(transaction, session)
     session.commit()
     session.refresh(transaction)
+    return transaction
 
-    # Convert datetime to string for JSON serialization
-    transaction_data = transaction.model_dump()
-    transaction_data['timestamp'] = transaction_data['timestamp'].isoformat()
 
-    # Publish transaction to Kafka
-    producer.send("transactions", transaction_data)
-    return transaction
+def parse_bulk_body(body: bytes, content_type: str) -> List:
+    if content_type.startswith(NDJSON_MEDIA_TYPE):
+        # A malformed line only fails its own item
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(INVALID_JSON)
+        return items
+
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body.")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of transactions.")
+    return items
+
+
+def bulk_row(item) -> Tuple[Optional[dict], Optional[str]]:
+    if item is INVALID_JSON:
+        return None, "Invalid JSON."
+    if not isinstance(item, dict):
+        return None, "Transaction must be a JSON object."
+    job_id = item.get("job_id")
+    if not isinstance(job_id, int) or isinstance(job_id, bool):
+        return None, "A job id is required."
+    error = transaction_error(item.get("account_debit"), item.get("account_credit"), item.get("amount"))
+    if error:
+        return None, error
+    try:
+        timestamp = parse_timestamp(item["timestamp"]) if item.get("timestamp") else datetime.now(timezone.utc)
+    except ValueError:
+        return None, "Invalid timestamp format."
+    return {
+        "job_id": job_id,
+        "account_debit": item["account_debit"],
+        "account_credit": item["account_credit"],
+        "amount": float(item["amount"]),
+        "timestamp": timestamp,
+    }, None
+
+
+def insert_transaction_rows(rows: List[dict], session: Session) -> List[int]:
+    if session.get_bind().dialect.name != "sqlite":
+        statement = insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True)
+        return session.execute(statement, rows).scalars().all()
+    # SQLite has no column to match RETURNING rows to parameters, so an ordered RETURNING would fall back to one
+    # INSERT per row. The first row takes the write lock and the next id instead, and the rest follow on the
+    # consecutive ids in one executemany: no other writer can insert while the lock is held.
+    first_id = session.execute(insert(Transaction).returning(Transaction.id), rows[0]).scalar_one()
+    ids = list(range(first_id, first_id + len(rows)))
+    if len(rows) > 1:
+        session.execute(insert(Transaction), [{"id": txn_id, **row} for txn_id, row in zip(ids[1:], rows[1:])])
+    return ids
+
+
+def create_transactions_bulk(items: List, session: Session) -> BulkIngestResult:
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ITEMS} transactions per request.")
+
+    # Validate every item in one pass, keeping the valid rows in request order
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        row, error = bulk_row(item)
+        results.append(BulkItemResult(index=index, error=error))
+        if row:
+            rows.append((index, row))
+
+    if rows:
+        # Two inserts and one commit for the whole batch
+        ids = insert_transaction_rows([row for _, row in rows], session)
+
+        # Queue the batch's Kafka events and balance changes in the same DB transaction
+        events = []
+        deltas = {}
+        for (index, row), txn_id in zip(rows, ids):
+            results[index].id = txn_id
+            events.append(transaction_event({"id": txn_id, **row}))
+            add_balance_delta(deltas, row["account_debit"], row["account_credit"], row["amount"])
+        session.execute(insert(OutboxEvent), events)
+        apply_balance_deltas(deltas, session)
+        rollups.record_transactions([
+            (row["job_id"], row["account_debit"], row["account_credit"], row["amount"], row["timestamp"])
+            for _, row in rows
+        ], session)
+        session.commit()
+
+    return BulkIngestResult(created=len(rows), failed=len(items) - len(rows), results=results)
+
+
+def add_balance_delta(deltas: Dict[str, List[float]], account_debit: str, account_credit: str, amount: float):
+    deltas.setdefault(account_debit, [0.0, 0.0])[0] += amount
+    deltas.setdefault(account_credit, [0.0, 0.0])[1] += amount
+
+
+def apply_balance_deltas(deltas: Dict[str, List[float]], session: Session):
+    if not deltas:
+        return
+    dialect_insert = postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = dialect_insert(AccountBalance)
+    statement = statement.on_conflict_do_update(
+        index_elements=[AccountBalance.account],
+        set_={
+            "debit_total": AccountBalance.debit_total + statement.excluded.debit_total,
+            "credit_total": AccountBalance.credit_total + statement.excluded.credit_total,
+            "balance": AccountBalance.balance + statement.excluded.balance,
+            "updated_at": statement.excluded.updated_at,
+        },
+    )
+    # Upsert in account order so concurrent writers take row locks in the same order
+    now = datetime.now(timezone.utc)
+    session.execute(statement, [
+        {"account": account, "debit_total": debit, "credit_total": credit, "balance": debit - credit, "updated_at": now}
+        for account, (debit, credit) in sorted(deltas.items())
+    ])
+
+
+def get_account_balance(account: str, session: Session) -> AccountBalance:
+    balance = session.exec(select(AccountBalance).where(AccountBalance.account == account)).first()
+    if not balance:
+        raise HTTPException(status_code=404, detail="Account not found.")
+    return balance
+
+
+def outbox_depth(session: Session) -> int:
+    return session.exec(select(func.count(OutboxEvent.id))).one()
+
+
+def trial_balance(
+        session: Session, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[TrialBalance, Optional[str]]:
+    total_debits, total_credits = session.exec(
+        select(func.coalesce(func.sum(AccountBalance.debit_total), 0.0),
+               func.coalesce(func.sum(AccountBalance.credit_total), 0.0))
+    ).one()
+    statement = select(AccountBalance).order_by(AccountBalance.account)
+    if cursor:
+        (last_account, last_id) = decode_cursor(cursor, 2)
+        statement = statement.where(AccountBalance.account > last_account)
+    accounts, next_cursor = paginate(session, statement, limit, lambda balance: (balance.account, balance.id))
+    return TrialBalance(
+        total_debits=total_debits,
+        total_credits=total_credits,
+        balanced=round(total_debits - total_credits, 2) == 0,
+        accounts=accounts,
+    ), next_cursor
+
+
+def rebuild_account_balances(session: Session):
+    # Backfill the projection from the effective ledger
+    deltas = {}
+    source = archive.transaction_source(session)
+    statement = (
+        select(source.account_debit, source.account_credit, source.amount)
+        .where(revision_index.not_superseded(source))
+        .execution_options(yield_per=STREAM_CHUNK_SIZE)
+    )
+    for account_debit, account_credit, amount in session.exec(statement):
+        add_balance_delta(deltas, account_debit, account_credit, amount)
+    session.exec(delete(AccountBalance))
+    apply_balance_deltas(deltas, session)
+    session.commit()
+
+
+def transaction_position(cursor: str, order_by: str) -> List:
+    if order_by == "timestamp":
+        last_timestamp, last_id = decode_cursor(cursor, 2)
+        try:
+            return [datetime.fromisoformat(last_timestamp), last_id]
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return decode_cursor(cursor, 1)
+
+
+def transaction_source(
+        session: Session, cursor: Optional[str] = None, order_by: str = "id", start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+):
+    # Archived rows are the oldest sealed ones, so a page that starts after them reads the hot table alone
+    start = rollups.as_utc(start) if start is not None else None
+    end = rollups.as_utc(end) if end is not None else None
+    first_id = None
+    if cursor and order_by == "timestamp":
+        last_timestamp = rollups.as_utc(transaction_position(cursor, order_by)[0])
+        start = last_timestamp if start is None else max(start, last_timestamp)
+    elif cursor:
+        first_id = transaction_position(cursor, order_by)[0] + 1
+    return archive.transaction_source(session, first_id=first_id, start=start, end=end)
+
+
+def transactions_query(cursor: Optional[str] = None, order_by: str = "id", source=Transaction):
+    if order_by == "timestamp":
+        # Keyset on (timestamp, id) so rows sharing a timestamp are not skipped
+        statement = table_columns(source).order_by(source.timestamp, source.id)
+        if cursor:
+            last_timestamp, last_id = transaction_position(cursor, order_by)
+            statement = statement.where(tuple_(source.timestamp, source.id) > tuple_(last_timestamp, last_id))
+        return statement
+
+    statement = table_columns(source).order_by(source.id)
+    if cursor:
+        (last_id,) = transaction_position(cursor, order_by)
+        statement = statement.where(source.id > last_id)
+    return statement
+
+
+def effective_transactions_query(cursor: Optional[str] = None, order_by: str = "id", source=Transaction):
+    return transactions_query(cursor, order_by, source).where(revision_index.not_superseded(source))
+
+
+def transaction_cursor_key(order_by: str):
+    if order_by == "timestamp":
+        return lambda txn: (txn.timestamp, txn.id)
+    return lambda txn: (txn.id,)
+
+
+def list_transactions(
+        session: Session, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, order_by: str = "id"
+) -> Tuple[Sequence[Row], Optional[str]]:
+    statement = transactions_query(cursor, order_by, transaction_source(session, cursor, order_by))
+    return paginate(session, statement, limit, transaction_cursor_key(order_by))
+
+
+def search_query(
+        account: Optional[str] = None, job_id: Optional[int] = None, amount_min: Optional[float] = None,
+        amount_max: Optional[float] = None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+        cursor: Optional[str] = None, source=Transaction
+):
+    # Each filter has an index to start from: (account_*, timestamp) on both sides of an account, (job_id,
+    # timestamp), amount, and timestamp. All but amount already hold rows in page order.
+    filters = []
+    if job_id is not None:
+        filters.append(source.job_id == job_id)
+    if amount_min is not None:
+        filters.append(source.amount >= amount_min)
+    if amount_max is not None:
+        filters.append(source.amount <= amount_max)
+    if start is not None:
+        filters.append(source.timestamp >= rollups.as_utc(start))
+    if end is not None:
+        filters.append(source.timestamp < rollups.as_utc(end))
+
+    if account is None and not filters:
+        raise HTTPException(status_code=400, detail="Pass at least one filter, or use /v1/transactions/list.")
+    narrowed = account is not None or job_id is not None or start is not None or end is not None
+    if not narrowed and (amount_min is None or amount_max is None):
+        # A one-sided amount range on its own matches most of the ledger, which would be read in full in
+        # timestamp order or sorted in full for every page
+        raise HTTPException(status_code=400, detail="Pass both 'amount_min' and 'amount_max', or another filter.")
+    if amount_min is not None and amount_max is not None and amount_min > amount_max:
+        raise HTTPException(status_code=400, detail="'amount_min' must not be above 'amount_max'.")
+    if start is not None and end is not None and rollups.as_utc(start) > rollups.as_utc(end):
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'.")
+
+    statement = transactions_query(cursor, "timestamp", source).where(*filters)
+    if account is None:
+        return statement
+    # One arm per side of the account, each read in (timestamp, id) order from its own index and merged, where
+    # an OR of the two would collect every match and sort it for each page. Plain labels keep the row keys str
+    # when the source is an aliased subquery.
+    arms = [statement.where(side == account).order_by(None) for side in (source.account_debit, source.account_credit)]
+    sides = union(*(arm.with_only_columns(*(column.label(column.key) for column in arm.selected_columns))
+                    for arm in arms))
+    return sides.order_by(sides.selected_columns.timestamp, sides.selected_columns.id)
 
 
-def list_transactions(session: Session) -> Sequence[Transaction]:
-    return session.exec(select(Transaction)).all()
+def search_transactions(
+        session: Session, account: Optional[str] = None, job_id: Optional[int] = None,
+        amount_min: Optional[float] = None, amount_max: Optional[float] = None, start: Optional[datetime] = None,
+        end: Optional[datetime] = None, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[Sequence[Row], Optional[str]]:
+    source = transaction_source(session, cursor, "timestamp", start, end)
+    statement = search_query(account, job_id, amount_min, amount_max, start, end, cursor, source)
+    return paginate(session, statement, limit, transaction_cursor_key("timestamp"))
+
+
+# Columns that make up a transaction's sealed contents, in merkle.transaction_fingerprint order
+SEAL_FIELDS = ("id", "job_id", "account_debit", "account_credit", "amount", "timestamp")
+# Postgres advisory lock key that serializes seals across processes
+SEAL_LOCK_KEY = 0x5EA1
+
+
+def seal_columns(source=Transaction):
+    return [getattr(source, field) for field in SEAL_FIELDS]
+
+
+def sealable_upper_id(session: Session) -> Optional[int]:
+    # Highest id below which every transaction is committed, or never will be
+    bind = session.get_bind()
+    if bind.dialect.name != "postgresql":
+        # SQLite has one writer at a time and gives each new row max(id) + 1 when it is inserted. So the row holding
+        # max(id) was inserted after every lower id had committed or rolled back, and none can appear below it later.
+        return session.exec(select(func.max(Transaction.id))).one()
+    # Postgres hands out sequence values as rows are inserted, but their transactions commit in any order: max(id)
+    # can be visible while a lower id is still in flight and would be skipped by every later seal. A SHARE lock
+    # waits for each transaction already writing to the table, and later writers draw higher ids. It is taken on a
+    # connection of its own, so inserts wait for this one query rather than the whole seal.
+    with bind.connect() as connection, connection.begin():
+        connection.execute(text(f'LOCK TABLE "{Transaction.__tablename__}" IN SHARE MODE'))
+        return connection.execute(select(func.max(Transaction.id))).scalar()
+
+
+def lock_seal_chain(session: Session):
+    # Held until the seal commits, so a seal in another worker or process cannot chain from the same predecessor.
+    # Must run before the session's first statement.
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        # The write lock; pysqlite would otherwise only begin at the first INSERT, after the reads it depends on
+        session.execute(text("BEGIN IMMEDIATE"))
+    elif dialect == "postgresql":
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SEAL_LOCK_KEY})
 
 
 def seal_transactions(session: Session) -> SealedManifest:
-    # Fetch all unsealed transactions
-    transactions = session.exec(select(Transaction)).all()
-    if not transactions:
+    lock_seal_chain(session)
+    # Continue the hash chain from the most recent manifest
+    previous = session.exec(select(SealedManifest).order_by(SealedManifest.id.desc()).limit(1)).first()
+    last_sealed_id = previous.last_transaction_id if previous else 0
+
+    # Fix the upper bound first so concurrent inserts land in the next seal
+    upper_id = sealable_upper_id(session)
+    if upper_id is None or upper_id <= last_sealed_id:
         raise HTTPException(status_code=400, detail="No transactions to seal.")
 
-    # Generate checksum
-    transactions_data = "".join([str(txn.id) for txn in transactions])
-    checksum = hashlib.sha256(transactions_data.encode()).hexdigest()
+    # Hash only the unsealed transactions, streamed in chunks, into the chain and the Merkle leaves
+    hasher = hashlib.sha256(previous.checksum.encode() if previous else b"")
+    statement = (
+        select(*seal_columns())
+        .where(Transaction.id > last_sealed_id, Transaction.id <= upper_id)
+        .order_by(Transaction.id)
+        .execution_options(yield_per=STREAM_CHUNK_SIZE)
+    )
+    leaves = []
+    leaf_ids = []
+    first_timestamp = last_timestamp = None
+    for rows in session.exec(statement).partitions():
+        for row in rows:
+            fingerprint = merkle.transaction_fingerprint(row)
+            hasher.update(fingerprint)
+            leaves.append(merkle.leaf_hash(fingerprint))
+            leaf_ids.append(row.id)
+            timestamp = row.timestamp
+            if first_timestamp is None or timestamp < first_timestamp:
+                first_timestamp = timestamp
+            if last_timestamp is None or timestamp > last_timestamp:
+                last_timestamp = timestamp
 
     # Create sealed manifest
-    manifest = SealedManifest(transaction_count=len(transactions), checksum=checksum)
+    levels = merkle.build_levels(leaves)
+    manifest = SealedManifest(
+        transaction_count=len(leaves),
+        checksum=hasher.hexdigest(),
+        merkle_root=levels[-1][0].hex(),
+        previous_checksum=previous.checksum if previous else None,
+        first_transaction_id=leaf_ids[0],
+        last_transaction_id=upper_id,
+        first_timestamp=first_timestamp,
+        last_timestamp=last_timestamp,
+    )
     session.add(manifest)
+    try:
+        session.flush()
+    except IntegrityError:
+        # Only reachable when something sealed these rows without taking the lock; the chain stays unforked
+        session.rollback()
+        raise HTTPException(status_code=409, detail="These transactions were sealed concurrently.")
+
+    # Store every level of the tree alongside the manifest in one executemany
+    nodes = [
+        {
+            "manifest_id": manifest.id,
+            "level": level,
+            "position": position,
+            "hash": node,
+            "transaction_id": leaf_ids[position] if level == 0 else None,
+        }
+        for level, hashes in enumerate(levels)
+        for position, node in enumerate(hashes)
+    ]
+    session.execute(insert(MerkleNode), nodes)
     session.commit()
     session.refresh(manifest)
     return manifest
 
 
-def revise_transaction(transaction_id: int, new_transaction: Transaction, session: Session) -> Revision:
-    # Find original transaction
-    original_transaction = session.get(Transaction, transaction_id)
+def list_effective_transactions(
+        session: Session, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, order_by: str = "id"
+) -> Tuple[Sequence[Row], Optional[str]]:
+    statement = effective_transactions_query(cursor, order_by, transaction_source(session, cursor, order_by))
+    return paginate(session, statement, limit, transaction_cursor_key(order_by))
+
+
+def transaction_history(transaction_id: int, session: Session) -> TransactionHistory:
+    version = session.exec(
+        select(TransactionVersion).where(TransactionVersion.transaction_id == transaction_id)
+    ).first()
+    if not version:
+        # Never revised: the transaction is its own history, and may have been archived
+        transaction = session.get(Transaction, transaction_id) or archive.archived_transaction(transaction_id, session)
+        if not transaction:
+            raise HTTPException(status_code=404, detail="Transaction not found.")
+        return TransactionHistory(
+            transaction_id=transaction_id, effective_transaction_id=transaction_id, versions=[transaction], revisions=[]
+        )
+
+    # Every version of the chain shares its root, so one indexed lookup finds them all
+    chain = select(TransactionVersion.transaction_id).where(
+        TransactionVersion.root_transaction_id == version.root_transaction_id
+    )
+    versions = session.exec(select(Transaction).where(Transaction.id.in_(chain)).order_by(Transaction.id)).all()
+    revisions = session.exec(
+        select(Revision).where(Revision.corrected_transaction_id.in_(chain)).order_by(Revision.id)
+    ).all()
+    return TransactionHistory(
+        transaction_id=transaction_id,
+        effective_transaction_id=version.effective_transaction_id,
+        versions=versions,
+        revisions=revisions,
+    )
+
+
+def transaction_proof(transaction_id: int, session: Session) -> InclusionProof:
+    leaf = session.exec(
+        select(MerkleNode).where(MerkleNode.transaction_id == transaction_id, MerkleNode.level == 0)
+    ).first()
+    if not leaf:
+        raise HTTPException(status_code=404, detail="Transaction is not sealed.")
+    manifest = session.get(SealedManifest, leaf.manifest_id)
+
+    # Fetch every sibling on the path to the root in one indexed query
+    siblings = merkle.sibling_positions(leaf.position, manifest.transaction_count)
+    nodes = {}
+    if siblings:
+        statement = select(MerkleNode).where(
+            MerkleNode.manifest_id == manifest.id,
+            tuple_(MerkleNode.level, MerkleNode.position).in_([(level, position) for level, position, _ in siblings]),
+        )
+        nodes = {(node.level, node.position): node.hash for node in session.exec(statement)}
+
+    return InclusionProof(
+        transaction_id=transaction_id,
+        manifest_id=manifest.id,
+        leaf_hash=leaf.hash.hex(),
+        merkle_root=manifest.merkle_root,
+        proof=[ProofStep(side=side, hash=nodes[(level, position)].hex()) for level, position, side in siblings],
+    )
+
+
+def verify_manifest(manifest_id: int, session: Session) -> ManifestVerification:
+    manifest = session.get(SealedManifest, manifest_id)
+    if not manifest:
+        raise HTTPException(status_code=404, detail="Sealed manifest not found.")
+
+    # Hash the covered transactions chunk by chunk, in a process pool for large manifests. Archived rows keep
+    # their ids, so the union of both tables in id order gives back the sealed leaves.
+    source = archive.transaction_source(
+        session, first_id=manifest.first_transaction_id, last_id=manifest.last_transaction_id
+    )
+    statement = (
+        select(*seal_columns(source))
+        .where(source.id >= manifest.first_transaction_id, source.id <= manifest.last_transaction_id)
+        .order_by(source.id)
+        .execution_options(yield_per=VERIFY_CHUNK_SIZE)
+    )
+    chunks = ([tuple(row) for row in rows] for rows in session.exec(statement).partitions())
+    workers = VERIFY_WORKERS if manifest.transaction_count > VERIFY_CHUNK_SIZE else 1
+    leaves = merkle.hash_leaves_parallel(chunks, workers)
+
+    root = merkle.merkle_root(leaves)
+    computed_root = root.hex() if root else None
+    return ManifestVerification(
+        manifest_id=manifest.id,
+        transaction_count=manifest.transaction_count,
+        verified_count=len(leaves),
+        merkle_root=manifest.merkle_root,
+        computed_root=computed_root,
+        valid=len(leaves) == manifest.transaction_count and computed_root == manifest.merkle_root,
+    )
+
+
+def add_revision(transaction_id: int, new_transaction: Transaction, session: Session) -> Revision:
+    validate_transaction(new_transaction)
+
+    # Find original transaction, bringing it back from the archive so the revision can reference it
+    original_transaction = (
+        session.get(Transaction, transaction_id) or archive.restore_transaction(transaction_id, session)
+    )
     if not original_transaction:
         raise HTTPException(status_code=404, detail="Original transaction not found.")
 
-    # Ensure timestamp is a datetime object
-    if isinstance(new_transaction.timestamp, str):
-        new_transaction.timestamp = datetime.fromisoformat(new_transaction.timestamp.replace("Z", "+00:00"))
-
     # Save the new transaction
     session.add(new_transaction)
-    session.commit()
-    session.refresh(new_transaction)
+    session.flush()
+
+    # Point the whole revision chain at the correction and find the version it replaces
+    previous_id = revision_index.record_revision(original_transaction.id, new_transaction.id, session)
+    previous_transaction = session.get(Transaction, previous_id)
+
+    # Swap the replaced version's effect on the account balances for the correction's
+    deltas = {}
+    add_balance_delta(
+        deltas, previous_transaction.account_debit, previous_transaction.account_credit, -previous_transaction.amount
+    )
+    add_balance_delta(deltas, new_transaction.account_debit, new_transaction.account_credit, new_transaction.amount)
+    apply_balance_deltas(deltas, session)
 
     # Log the revision
     revision = Revision(
@@ -99,10 +691,61 @@ def revise_transaction(transaction_id: int, new_transaction: Transaction, sessio
         timestamp=datetime.now(timezone.utc)
     )
     session.add(revision)
+    session.flush()
+
+    # The replaced version's buckets lost a member and are rebuilt; the correction is merged into the rest
+    superseded_buckets = set(rollups.bucket_keys(
+        previous_transaction.job_id, previous_transaction.account_debit, previous_transaction.account_credit,
+        previous_transaction.timestamp
+    ))
+    # Other members of those buckets may be archived
+    source = archive.transaction_source(session, start=min(start for *_, start in superseded_buckets))
+    rollups.recompute_buckets(superseded_buckets, session, source)
+    buckets = {}
+    rollups.add_to_buckets(
+        buckets, new_transaction.job_id, new_transaction.account_debit, new_transaction.account_credit,
+        new_transaction.amount, new_transaction.timestamp
+    )
+    rollups.merge_buckets({bucket: stats for bucket, stats in buckets.items() if bucket not in superseded_buckets},
+                          session)
+    return revision
+
+
+def revise_transaction(transaction_id: int, new_transaction: Transaction, session: Session) -> Revision:
+    revision = add_revision(transaction_id, new_transaction, session)
     session.commit()
     session.refresh(revision)
     return revision
 
 
-def list_revisions(session: Session) -> Sequence[Revision]:
-    return session.exec(select(Revision)).all()
+def rollup_report(
+        session: Session, job_id: Optional[int], account: Optional[str], start: datetime, end: datetime,
+        granularity: str
+) -> Sequence[Rollup]:
+    if (job_id is None) == (account is None):
+        raise HTTPException(status_code=400, detail="Pass exactly one of job_id or account.")
+    # A naive and an aware bound cannot be compared as they are
+    start, end = rollups.as_utc(start), rollups.as_utc(end)
+    if start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'.")
+    if job_id is not None:
+        return rollups.rollup_buckets(session, "job", str(job_id), granularity, start, end)
+    return [
+        *rollups.rollup_buckets(session, "account_debit", account, granularity, start, end),
+        *rollups.rollup_buckets(session, "account_credit", account, granularity, start, end),
+    ]
+
+
+def revisions_query(cursor: Optional[str] = None):
+    statement = table_columns(Revision).order_by(Revision.id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        statement = statement.where(Revision.id > last_id)
+    return statement
+
+
+def list_revisions(
+        session: Session, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[Sequence[Row], Optional[str]]:
+    return paginate(session, revisions_query(cursor), limit, lambda revision: (revision.id,))
+
@@ -1,12 +1,44 @@
-from datetime import datetime, timezone
+import asyncio
+import csv
+import io
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 
 import pytest
+import sqlalchemy
+from fastapi import FastAPI, HTTPException
 from fastapi.testclient import TestClient
-from sqlmodel import Session, delete
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, create_engine, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from config import engine
+import admission
+import archive
+import async_services
+import config
+import main
+import merkle
+import metrics
+import response_cache
+import revision_index
+import rollups
+import serve
+import services
+from config import ASYNC_DATABASE_URL, engine, async_engine
 from main import app
-from models import Transaction
+from event_sinks import EventSink, InMemorySink, FileSink
+from migration_utils import catch_up, chunk_checksum, shadow_migration, verify_migration
+from models import (
+    Job, Transaction, ArchivedTransaction, Revision, OutboxEvent, AccountBalance, TransactionVersion, SealedManifest,
+    MerkleNode, Rollup
+)
+from outbox import OutboxDispatcher
+from write_pipeline import WritePipeline
 
 client = TestClient(app)
 
@@ -40,8 +72,12 @@ def sample_revision(sample_transaction):
 
 @pytest.fixture
 def no_transactions():
+    # Everything keyed by transaction ids goes too, or SQLite would hand the freed ids to new rows that then collide
+    # with stale versions, leaves and manifests
     with Session(engine) as session:
-        session.exec(delete(Transaction))
+        for model in (Revision, TransactionVersion, MerkleNode, SealedManifest, AccountBalance, Rollup,
+                      ArchivedTransaction, Transaction):
+            session.exec(delete(model))
         session.commit()
         yield
 
@@ -161,7 +197,852 @@ def test_revise_non_existent_transaction():
     assert response.status_code == 404
 
 
+def test_revise_transaction_rejects_invalid_corrections(sample_transaction):
+    ride = {key: sample_transaction[key] for key in ("job_id", "account_debit", "account_credit", "timestamp")}
+    balance = client.get(f"/v1/accounts/{ride['account_credit']}/balance").json()
+    without_credit = {key: value for key, value in ride.items() if key != "account_credit"}
+    for correction in ({**ride, "amount": -50.0}, {**without_credit, "amount": 50.0},
+                       {**ride, "timestamp": "bad", "amount": 50.0}):
+        response = client.post(f"/v1/transactions/{sample_transaction['id']}/revise", json=correction)
+        assert response.status_code == 400
+    assert client.get(f"/v1/accounts/{ride['account_credit']}/balance").json() == balance
+
+
 def test_list_revisions_returns_all_revisions(sample_revision):
     response = client.get("/v1/revisions/list")
     assert response.status_code == 200
-    assert len(response.json()) > 0
\ No newline at end of file
+    assert len(response.json()) > 0
+
+def test_list_transactions_paginates_with_cursor(sample_job):
+    for amount in (10.0, 20.0, 30.0):
+        client.post("/v1/transactions/create", json={
+            "job_id": sample_job["id"],
+            "account_debit": "DE89370400440532013000",
+            "account_credit": "DE89370400440532013001",
+            "amount": amount,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        })
+    first_page = client.get("/v1/transactions/list", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert len(first_page.json()) == 2
+    cursor = first_page.headers["X-Next-Cursor"]
+
+    second_page = client.get("/v1/transactions/list", params={"limit": 2, "cursor": cursor})
+    assert second_page.status_code == 200
+    assert second_page.json()[0]["id"] > first_page.json()[-1]["id"]
+
+
+def test_list_transactions_by_timestamp_paginates_with_cursor(sample_revision):
+    first_page = client.get("/v1/transactions/list", params={"limit": 1, "order_by": "timestamp"})
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = client.get("/v1/transactions/list", params={"limit": 1, "order_by": "timestamp", "cursor": cursor})
+    assert second_page.status_code == 200
+    assert second_page.json()[0]["timestamp"] >= first_page.json()[0]["timestamp"]
+    assert second_page.json()[0]["id"] != first_page.json()[0]["id"]
+
+
+def test_list_transactions_with_invalid_cursor():
+    response = client.get("/v1/transactions/list", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_search_transactions_combines_filters_and_paginates(sample_job):
+    account, other = f"ACC-{uuid.uuid4().hex}", f"ACC-{uuid.uuid4().hex}"
+    rides = [(account, other, 10.0, "2024-05-01T08:00:00Z"), (other, account, 20.0, "2024-05-02T08:00:00Z"),
+             (account, other, 30.0, "2024-05-03T08:00:00Z"), (other, "ACC-NONE", 40.0, "2024-05-04T08:00:00Z")]
+    for debit, credit, amount, timestamp in rides:
+        client.post("/v1/transactions/create", json={"job_id": sample_job["id"], "account_debit": debit,
+                                                     "account_credit": credit, "amount": amount,
+                                                     "timestamp": timestamp})
+
+    first_page = client.get("/v1/transactions/search", params={"account": account, "limit": 2})
+    second_page = client.get("/v1/transactions/search", params={
+        "account": account, "limit": 2, "cursor": first_page.headers["X-Next-Cursor"]
+    })
+    assert [t["amount"] for t in first_page.json() + second_page.json()] == [10.0, 20.0, 30.0]
+
+    narrowed = client.get("/v1/transactions/search", params={
+        "account": account, "job_id": sample_job["id"], "amount_min": 15, "amount_max": 35,
+        "from": "2024-05-02T00:00:00Z", "to": "2024-05-03T00:00:00Z",
+    })
+    assert [t["amount"] for t in narrowed.json()] == [20.0]
+    assert client.get("/v1/transactions/search").status_code == 400
+
+
+def test_search_filters_use_an_index():
+    filters = {
+        "account": "DE89370400440532013000", "job_id": 1, "amount_min": 10.0, "amount_max": 20.0,
+        "start": datetime(2024, 1, 1, tzinfo=timezone.utc), "end": datetime(2024, 2, 1, tzinfo=timezone.utc),
+    }
+    combinations = [
+        {"account"}, {"job_id"}, {"amount_min", "amount_max"}, {"start", "end"}, {"start"}, {"end"},
+        {"account", "job_id"}, {"account", "start", "end"}, {"account", "amount_min", "amount_max"},
+        {"account", "amount_min"}, {"job_id", "start", "end"}, {"job_id", "amount_min"}, {"start", "amount_max"},
+        {"amount_min", "amount_max", "start", "end"}, set(filters),
+    ]
+    # First pages have no cursor, so the keyset predicate cannot lend the timestamp index a range
+    cursors = [None, services.encode_cursor("2024-01-15T00:00:00+00:00", 1)]
+    for names in combinations:
+        for cursor in cursors:
+            statement = services.search_query(**{name: filters[name] for name in names}, cursor=cursor).limit(100)
+            with engine.connect() as connection:
+                # Run the query once to get the SQL and parameters exactly as the driver sees them
+                executed = []
+                sqlalchemy.event.listen(connection, "before_cursor_execute",
+                                        lambda conn, cur, sql, params, *args: executed.append((sql, params)))
+                connection.execute(statement).all()
+                sql, params = executed[-1]
+                plan = [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params)]
+            # SEARCH is an index lookup; SCAN would read the whole table or index
+            accesses = [step for step in plan if step.startswith(("SCAN", "SEARCH"))]
+            assert accesses and all(step.startswith("SEARCH") for step in accesses), (names, cursor, plan)
+            # Only an amount range on its own has no index in page order, and sorts its matches
+            if names != {"amount_min", "amount_max"}:
+                assert not any("TEMP B-TREE" in step for step in plan), (names, cursor, plan)
+
+
+def test_search_rejects_a_lone_open_amount_bound():
+    for bound in ({"amount_min": 10.0}, {"amount_max": 10.0}):
+        assert client.get("/v1/transactions/search", params=bound).status_code == 400
+    assert client.get("/v1/transactions/search", params={"amount_min": 10.0, "job_id": 1}).status_code == 200
+
+
+def test_list_jobs_streams_ndjson(sample_job):
+    response = client.get("/v1/jobs/list", params={"stream": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.strip().split("\n")
+    assert any(json.loads(line)["id"] == sample_job["id"] for line in lines)
+
+
+def test_encode_rows_matches_model_json(sample_revision):
+    with Session(engine) as session:
+        statement = select(Transaction).order_by(Transaction.id.desc()).limit(10)
+        models = session.exec(statement).all()
+        rows = session.exec(services.table_columns(Transaction).order_by(Transaction.id.desc()).limit(10)).all()
+    assert json.loads(services.encode_rows(rows)) == [json.loads(model.model_dump_json()) for model in models]
+
+
+def test_seal_transactions_only_seals_new_transactions(sample_transaction):
+    first = create_sample_sealed_manifest().json()
+    assert first["last_transaction_id"] >= sample_transaction["id"]
+
+    # Nothing new since the last seal
+    assert create_sample_sealed_manifest().status_code == 400
+
+    new_transaction = client.post("/v1/transactions/create", json={
+        "job_id": sample_transaction["job_id"],
+        "account_debit": "DE89370400440532013000",
+        "account_credit": "DE89370400440532013001",
+        "amount": 50.0,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }).json()
+    second = create_sample_sealed_manifest().json()
+    assert second["transaction_count"] == 1
+    assert second["first_transaction_id"] == new_transaction["id"]
+    assert second["previous_checksum"] == first["checksum"]
+
+
+def test_transaction_proof_verifies_against_manifest_root(sample_transaction):
+    manifest = create_sample_sealed_manifest().json()
+    response = client.get(f"/v1/transactions/{sample_transaction['id']}/proof")
+    assert response.status_code == 200
+    proof = response.json()
+    assert proof["manifest_id"] == manifest["id"]
+    assert proof["merkle_root"] == manifest["merkle_root"]
+    steps = [(step["side"], bytes.fromhex(step["hash"])) for step in proof["proof"]]
+    assert merkle.verify_proof(bytes.fromhex(proof["leaf_hash"]), steps, bytes.fromhex(proof["merkle_root"]))
+
+
+def test_a_seal_holds_the_write_lock_until_it_commits(sample_transaction):
+    other_engine = create_engine(engine.url, connect_args={"timeout": 0})
+    try:
+        with Session(engine) as session:
+            services.lock_seal_chain(session)
+            with other_engine.connect() as other:
+                with pytest.raises(sqlalchemy.exc.OperationalError, match="locked"):
+                    other.exec_driver_sql("BEGIN IMMEDIATE")
+    finally:
+        other_engine.dispose()
+
+
+def test_a_racing_seal_fails_instead_of_forking_the_chain(sample_transaction, monkeypatch):
+    # A seal that skipped the lock lands while this one is hashing; both chain from the same predecessor
+    monkeypatch.setattr(services, "lock_seal_chain", lambda session: None)
+    upper_id = services.sealable_upper_id
+
+    def racing_upper_id(session):
+        monkeypatch.setattr(services, "sealable_upper_id", upper_id)
+        with Session(engine) as racing:
+            services.seal_transactions(racing)
+        return upper_id(session)
+
+    monkeypatch.setattr(services, "sealable_upper_id", racing_upper_id)
+    with Session(engine) as session:
+        with pytest.raises(HTTPException) as error:
+            services.seal_transactions(session)
+    assert error.value.status_code == 409
+
+
+def test_transaction_proof_for_unsealed_transaction(sample_transaction):
+    response = client.get(f"/v1/transactions/{sample_transaction['id']}/proof")
+    assert response.status_code == 404
+
+
+def test_verify_manifest_detects_tampering(sample_transaction):
+    manifest = create_sample_sealed_manifest().json()
+    response = client.get(f"/v1/manifests/{manifest['id']}/verify")
+    assert response.status_code == 200
+    assert response.json()["valid"] is True
+
+    with Session(engine) as session:
+        transaction = session.get(Transaction, sample_transaction["id"])
+        transaction.amount = 1.0
+        session.add(transaction)
+        session.commit()
+    response = client.get(f"/v1/manifests/{manifest['id']}/verify")
+    assert response.json()["valid"] is False
+
+
+def test_hash_leaves_parallel_matches_serial_hashing():
+    rows = [(i, 1, "DE01", "DE02", float(i), datetime(2024, 1, 1, tzinfo=timezone.utc)) for i in range(1, 101)]
+    chunks = [rows[i:i + 10] for i in range(0, len(rows), 10)]
+    assert merkle.hash_leaves_parallel(chunks, 2) == merkle.hash_leaves(rows)
+
+
+def test_bulk_create_transactions_reports_per_item_results(sample_job):
+    valid = {
+        "job_id": sample_job["id"],
+        "account_debit": "DE89370400440532013000",
+        "account_credit": "DE89370400440532013001",
+        "amount": 100.0,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+    response = client.post("/v1/transactions/bulk", json=[valid, {**valid, "amount": -1.0}, valid])
+    assert response.status_code == 200
+    body = response.json()
+    assert body["created"] == 2
+    assert body["failed"] == 1
+    assert body["results"][1]["error"] == "Transaction amount must be positive."
+    assert body["results"][0]["id"] < body["results"][2]["id"]
+
+
+def test_bulk_create_transactions_accepts_ndjson(sample_job):
+    line = json.dumps({
+        "job_id": sample_job["id"],
+        "account_debit": "DE89370400440532013000",
+        "account_credit": "DE89370400440532013001",
+        "amount": 10.0
+    })
+    response = client.post("/v1/transactions/bulk", content="\n".join([line, "{not json", line]),
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["created"] == 2
+    assert body["results"][1]["error"] == "Invalid JSON."
+
+
+def test_bulk_create_transactions_inserts_in_two_statements(sample_job):
+    items = [{"job_id": sample_job["id"], "account_debit": "DE01", "account_credit": "DE02", "amount": float(amount)}
+             for amount in range(1, 51)]
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    sqlalchemy.event.listen(async_engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        body = client.post("/v1/transactions/bulk", json=items).json()
+    finally:
+        sqlalchemy.event.remove(async_engine.sync_engine, "before_cursor_execute", listener)
+
+    ids = [result["id"] for result in body["results"]]
+    assert body["created"] == 50 and ids == list(range(ids[0], ids[0] + 50))
+    assert sum(statement.startswith('INSERT INTO "transaction"') for statement in statements) == 2
+    assert len(statements) <= 6
+    with Session(engine) as session:
+        assert session.get(Transaction, ids[-1]).amount == 50.0
+
+
+class Undelivered:
+    def succeeded(self):
+        return False
+
+
+class FailingSink(InMemorySink):
+    def send(self, topic, value):
+        return Undelivered()
+
+
+def test_outbox_dispatcher_publishes_and_clears_events(sample_transaction):
+    event_sink = InMemorySink()
+    dispatcher = OutboxDispatcher(event_sink, engine, batch_size=100000)
+    assert dispatcher.dispatch_once() > 0
+    published = [json.loads(value)["id"] for topic, value in event_sink.events if topic == "transactions"]
+    assert sample_transaction["id"] in published
+    with Session(engine) as session:
+        assert session.exec(select(OutboxEvent)).first() is None
+
+
+def test_outbox_dispatcher_keeps_undelivered_events(sample_transaction):
+    dispatcher = OutboxDispatcher(FailingSink(), engine, batch_size=100000)
+    assert dispatcher.dispatch_once() == 0
+    with Session(engine) as session:
+        assert session.exec(select(OutboxEvent)).first() is not None
+
+
+def test_event_sinks_must_implement_send():
+    class Unfinished(EventSink):
+        pass
+
+    with pytest.raises(TypeError):
+        Unfinished()
+    # The default needs no broker to start
+    assert config.EVENT_SINK == "file"
+
+
+def test_file_sink_appends_ndjson_events(tmp_path):
+    path = tmp_path / "events.ndjson"
+    event_sink = FileSink(str(path))
+    event_sink.send("transactions", b'{"id": 1}')
+    event_sink.send("transactions", b'{"id": 2}')
+    event_sink.flush()
+    event_sink.close()
+    lines = path.read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"topic": "transactions", "value": {"id": 1}},
+        {"topic": "transactions", "value": {"id": 2}},
+    ]
+
+
+def test_write_pipeline_group_commits_concurrent_writes(sample_job):
+    async def scenario():
+        pipeline = WritePipeline(async_engine, window_ms=5)
+        pipeline.start()
+        jobs = [Job(name=f"Driver {i}") for i in range(20)]
+        invalid = Transaction(job_id=sample_job["id"], account_debit="DE01", account_credit="DE02", amount=-1.0)
+        results = await asyncio.gather(
+            *[pipeline.submit(services.add_job, job) for job in jobs],
+            pipeline.submit(services.add_transaction, invalid),
+            return_exceptions=True
+        )
+        await pipeline.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    created, rejected = results[:-1], results[-1]
+    assert len({job.id for job in created}) == 20
+    assert isinstance(rejected, HTTPException) and rejected.status_code == 400
+    with Session(engine) as session:
+        assert session.get(Job, created[0].id).name == "Driver 0"
+
+
+def test_write_pipeline_commits_each_batch_once():
+    statements = []
+
+    async def scenario():
+        # A pool-less engine of its own, so every statement the pipeline sends is traced by SQLite itself
+        pipeline_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+
+        @sqlalchemy.event.listens_for(pipeline_engine.sync_engine, "connect")
+        def trace(dbapi_connection, connection_record):
+            dbapi_connection.await_(dbapi_connection._connection.set_trace_callback(statements.append))
+
+        pipeline = WritePipeline(pipeline_engine, window_ms=20)
+        pipeline.start()
+        created = await asyncio.gather(*[pipeline.submit(services.add_job, Job(name=f"Batch {i}")) for i in range(5)])
+        await pipeline.stop()
+        await pipeline_engine.dispose()
+        return created
+
+    created = asyncio.run(scenario())
+    verbs = [statement.split()[0].upper() for statement in statements]
+    assert verbs.count("INSERT") == 5 and verbs.count("RELEASE") == 5
+    assert verbs.count("BEGIN") == 1 and verbs.count("COMMIT") == 1
+    with Session(engine) as session:
+        assert session.get(Job, created[-1].id).name == "Batch 4"
+
+
+def test_account_balance_tracks_creates_and_revisions(sample_job):
+    debit, credit, corrected = (f"ACC-{uuid.uuid4().hex}" for _ in range(3))
+    transaction = client.post("/v1/transactions/create", json={
+        "job_id": sample_job["id"],
+        "account_debit": debit,
+        "account_credit": credit,
+        "amount": 100.0,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }).json()
+    assert client.get(f"/v1/accounts/{debit}/balance").json()["balance"] == 100.0
+    assert client.get(f"/v1/accounts/{credit}/balance").json()["balance"] == -100.0
+
+    client.post(f"/v1/transactions/{transaction['id']}/revise", json={
+        "job_id": sample_job["id"],
+        "account_debit": debit,
+        "account_credit": corrected,
+        "amount": 80.0,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+    assert client.get(f"/v1/accounts/{debit}/balance").json()["balance"] == 80.0
+    assert client.get(f"/v1/accounts/{credit}/balance").json()["balance"] == 0.0
+    assert client.get(f"/v1/accounts/{corrected}/balance").json()["balance"] == -80.0
+
+
+def test_account_balance_for_unknown_account():
+    response = client.get(f"/v1/accounts/ACC-{uuid.uuid4().hex}/balance")
+    assert response.status_code == 404
+
+
+def test_trial_balance_is_balanced(sample_transaction):
+    response = client.get("/v1/accounts/trial-balance")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["balanced"] is True
+    assert body["total_debits"] == pytest.approx(body["total_credits"])
+
+
+def test_reconciliation_reports_drifted_balances(sample_job):
+    debit, credit = f"ACC-{uuid.uuid4().hex}", f"ACC-{uuid.uuid4().hex}"
+    ride = {"job_id": sample_job["id"], "account_debit": debit, "account_credit": credit}
+    transaction = client.post("/v1/transactions/create", json={**ride, "amount": 10.1}).json()
+    client.post(f"/v1/transactions/{transaction['id']}/revise", json={**ride, "amount": 12.2})
+
+    def discrepancies():
+        report = client.get("/v1/reports/reconciliation").json()
+        keys = {debit, credit, str(sample_job["id"]), str(transaction["id"])}
+        return [(d["check"], d["key"], d["expected"], d["actual"]) for d in report["discrepancies"] if d["key"] in keys]
+
+    assert discrepancies() == []
+    with Session(engine) as session:
+        balance = session.exec(select(AccountBalance).where(AccountBalance.account == debit)).one()
+        balance.debit_total += 1.5
+        session.commit()
+    assert discrepancies() == [("account_debits", debit, 12.2, 13.7)]
+
+    with Session(engine) as session:
+        services.rebuild_account_balances(session)
+    assert discrepancies() == []
+
+
+def test_rebuild_account_balances_replays_history(sample_job):
+    debit, credit = f"ACC-{uuid.uuid4().hex}", f"ACC-{uuid.uuid4().hex}"
+    transaction = client.post("/v1/transactions/create", json={
+        "job_id": sample_job["id"], "account_debit": debit, "account_credit": credit, "amount": 100.0
+    }).json()
+    client.post(f"/v1/transactions/{transaction['id']}/revise", json={
+        "job_id": sample_job["id"], "account_debit": debit, "account_credit": credit, "amount": 60.0
+    })
+    with Session(engine) as session:
+        services.rebuild_account_balances(session)
+    assert client.get(f"/v1/accounts/{debit}/balance").json()["balance"] == 60.0
+    assert client.get(f"/v1/accounts/{credit}/balance").json()["balance"] == -60.0
+
+
+def test_rollup_report_aggregates_and_follows_revisions():
+    job = client.post("/v1/jobs/create", json={"name": "Driver"}).json()
+    rides = [("2024-03-04T08:00:00+00:00", 10.0), ("2024-03-04T18:00:00+00:00", 30.0), ("2024-03-20T12:00:00+00:00", 5.0)]
+    created = [client.post("/v1/transactions/create", json={
+        "job_id": job["id"],
+        "account_debit": "DE89370400440532013000",
+        "account_credit": "DE89370400440532013001",
+        "amount": amount,
+        "timestamp": timestamp
+    }).json() for timestamp, amount in rides]
+    params = {"job_id": job["id"], "from": "2024-03-01T00:00:00Z", "to": "2024-03-31T00:00:00Z"}
+
+    days = client.get("/v1/reports/rollup", params={**params, "granularity": "day"}).json()
+    assert [(b["transaction_count"], b["amount_total"], b["amount_min"], b["amount_max"]) for b in days] == [
+        (2, 40.0, 10.0, 30.0), (1, 5.0, 5.0, 5.0)
+    ]
+
+    # Revising the largest ride drops it from its bucket's max
+    client.post(f"/v1/transactions/{created[1]['id']}/revise", json={
+        "job_id": job["id"],
+        "account_debit": "DE89370400440532013000",
+        "account_credit": "DE89370400440532013001",
+        "amount": 12.0,
+        "timestamp": "2024-03-04T18:00:00+00:00"
+    })
+    month = client.get("/v1/reports/rollup", params={**params, "granularity": "month"}).json()
+    assert [(b["transaction_count"], b["amount_total"], b["amount_min"], b["amount_max"]) for b in month] == [
+        (3, 27.0, 5.0, 12.0)
+    ]
+
+    with Session(engine) as session:
+        rollups.backfill(session)
+    backfilled = client.get("/v1/reports/rollup", params={**params, "granularity": "month"}).json()
+    assert [(b["transaction_count"], b["amount_total"], b["amount_min"], b["amount_max"]) for b in backfilled] == [
+        (3, 27.0, 5.0, 12.0)
+    ]
+
+
+def test_rollup_report_requires_a_single_dimension():
+    response = client.get("/v1/reports/rollup", params={"from": "2024-03-01T00:00:00Z", "to": "2024-03-31T00:00:00Z"})
+    assert response.status_code == 400
+
+
+def test_rollup_report_accepts_mixed_offsets(sample_job):
+    params = {"job_id": sample_job["id"], "granularity": "day"}
+    mixed = client.get("/v1/reports/rollup",
+                       params={**params, "from": "2024-03-01T00:00:00Z", "to": "2024-03-31T00:00:00"})
+    assert mixed.status_code == 200
+    reversed_window = client.get("/v1/reports/rollup",
+                                 params={**params, "from": "2024-03-31T00:00:00", "to": "2024-03-01T00:00:00Z"})
+    assert reversed_window.status_code == 400
+
+
+def test_export_transactions_as_csv_within_window(sample_job):
+    day = {"job_id": sample_job["id"], "account_debit": "EXPORT-A", "account_credit": "EXPORT-B"}
+    rides = ((1.5, "1999-03-01T10:00:00Z"), (2.5, "1999-03-31T23:59:59Z"), (3.5, "1999-04-01T00:00:00Z"))
+    for amount, timestamp in rides:
+        client.post("/v1/transactions/create", json={**day, "amount": amount, "timestamp": timestamp})
+
+    window = {"from": "1999-03-01T00:00:00Z", "to": "1999-04-01T00:00:00Z"}
+    response = client.get("/v1/exports/transactions", params=window)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(row["amount"], row["timestamp"]) for row in rows] == [
+        ("1.5", "1999-03-01T10:00:00+00:00"), ("2.5", "1999-03-31T23:59:59+00:00")
+    ]
+
+
+def test_export_transactions_as_arrow_file(sample_transaction):
+    pa = pytest.importorskip("pyarrow")
+    response = client.get("/v1/exports/transactions", params={
+        "from": sample_transaction["timestamp"], "to": "2100-01-01T00:00:00Z", "format": "arrow"
+    })
+    table = pa.ipc.open_file(pa.BufferReader(response.content)).read_all()
+    assert sample_transaction["id"] in table.column("id").to_pylist()
+
+
+def test_archived_transactions_stay_readable_verifiable_and_revisable(sample_job):
+    debit, credit = f"ACC-{uuid.uuid4().hex}", f"ACC-{uuid.uuid4().hex}"
+    ride = {"job_id": sample_job["id"], "account_debit": debit, "account_credit": credit}
+    old = [client.post("/v1/transactions/create", json={**ride, "amount": amount, "timestamp": timestamp}).json()
+           for amount, timestamp in ((1.0, "1990-01-01T00:00:00Z"), (2.0, "1990-02-01T00:00:00Z"))]
+    recent = client.post("/v1/transactions/create", json={**ride, "amount": 3.0}).json()
+    manifest = client.post("/v1/transactions/seal").json()
+
+    with Session(engine) as session:
+        archive.archive_transactions(session, datetime(1991, 1, 1, tzinfo=timezone.utc))
+        assert session.exec(select(ArchivedTransaction.id).where(ArchivedTransaction.account_debit == debit)).all() \
+            == [transaction["id"] for transaction in old]
+        assert session.exec(select(Transaction.id).where(Transaction.account_debit == debit)).all() == [recent["id"]]
+
+    # Windows that reach the archive read through the union, later ones only the hot table
+    search = client.get("/v1/transactions/search", params={"account": debit}).json()
+    assert [row["id"] for row in search] == [old[0]["id"], old[1]["id"], recent["id"]]
+    recent_only = client.get("/v1/transactions/search", params={"account": debit, "from": "1991-01-01T00:00:00Z"})
+    assert [row["id"] for row in recent_only.json()] == [recent["id"]]
+    assert client.get(f"/v1/manifests/{manifest['id']}/verify").json()["valid"]
+    assert client.get(f"/v1/transactions/{old[0]['id']}/proof").status_code == 200
+    assert client.get(f"/v1/transactions/{old[0]['id']}/history").json()["versions"][0]["amount"] == 1.0
+
+    # Revising an archived transaction brings it back to the hot table under its id
+    revision = client.post(f"/v1/transactions/{old[0]['id']}/revise", json={**ride, "amount": 1.5})
+    assert revision.status_code == 200
+    with Session(engine) as session:
+        assert session.get(Transaction, old[0]["id"]) and not session.get(ArchivedTransaction, old[0]["id"])
+    report = client.get("/v1/reports/reconciliation").json()
+    assert [d for d in report["discrepancies"] if d["key"] in {debit, credit, str(sample_job["id"])}] == []
+    assert client.get(f"/v1/accounts/{debit}/balance").json()["debit_total"] == 6.5
+
+
+def test_revision_chain_resolves_to_latest_version(sample_job):
+    debit, credit = f"ACC-{uuid.uuid4().hex}", f"ACC-{uuid.uuid4().hex}"
+
+    def ride(amount):
+        return {"job_id": sample_job["id"], "account_debit": debit, "account_credit": credit, "amount": amount}
+
+    original = client.post("/v1/transactions/create", json=ride(100.0)).json()
+    first = client.post(f"/v1/transactions/{original['id']}/revise", json=ride(90.0)).json()
+    second = client.post(f"/v1/transactions/{first['corrected_transaction_id']}/revise", json=ride(80.0)).json()
+    # Revising an old version again supersedes the current one
+    third = client.post(f"/v1/transactions/{original['id']}/revise", json=ride(70.0)).json()
+
+    history = client.get(f"/v1/transactions/{second['corrected_transaction_id']}/history").json()
+    assert history["effective_transaction_id"] == third["corrected_transaction_id"]
+    assert [v["amount"] for v in history["versions"]] == [100.0, 90.0, 80.0, 70.0]
+    assert len(history["revisions"]) == 3
+    assert client.get(f"/v1/accounts/{debit}/balance").json()["balance"] == 70.0
+
+    effective_ids = [t["id"] for t in client.get("/v1/transactions/effective",
+                                                 params={"cursor": services.encode_cursor(original["id"] - 1)}).json()]
+    assert third["corrected_transaction_id"] in effective_ids
+    assert original["id"] not in effective_ids
+    assert first["corrected_transaction_id"] not in effective_ids
+
+
+def test_transaction_history_of_unrevised_transaction(sample_transaction):
+    history = client.get(f"/v1/transactions/{sample_transaction['id']}/history").json()
+    assert history["effective_transaction_id"] == sample_transaction["id"]
+    assert len(history["versions"]) == 1
+
+
+def test_rebuild_revision_index_matches_incremental_index(sample_revision):
+    with Session(engine) as session:
+        before = {v.transaction_id: v.effective_transaction_id for v in session.exec(select(TransactionVersion))}
+        revision_index.rebuild(session)
+        after = {v.transaction_id: v.effective_transaction_id for v in session.exec(select(TransactionVersion))}
+    assert after == before
+
+
+def test_shadow_migration_copies_in_chunks_and_resumes(sample_revision, tmp_path):
+    new_engine = create_engine(f"sqlite:///{tmp_path / 'new_database.db'}")
+    copied = shadow_migration(engine, new_engine, chunk_size=7, workers=2)
+    with Session(engine) as old_session, Session(new_engine) as new_session:
+        for model in (Job, Transaction, Revision):
+            assert new_session.exec(select(func.count()).select_from(model)).one() == \
+                   old_session.exec(select(func.count()).select_from(model)).one()
+    assert copied["transaction"] > 0
+
+    # A rerun picks up from the checkpoints and only copies what is new
+    client.post("/v1/jobs/create", json={"name": "Driver"})
+    assert shadow_migration(engine, new_engine, chunk_size=7, workers=2)["job"] == 1
+
+
+def test_live_migration_catches_up_with_updates(sample_transaction, tmp_path):
+    new_engine = create_engine(f"sqlite:///{tmp_path / 'new_database.db'}")
+    shadow_migration(engine, new_engine, chunk_size=7, workers=2)
+
+    # A revision appends rows and also rewrites balances, rollups and the version chain in place
+    client.post(f"/v1/transactions/{sample_transaction['id']}/revise", json={
+        **{key: sample_transaction[key] for key in ("job_id", "account_debit", "account_credit", "timestamp")},
+        "amount": 350.0,
+    })
+    report = verify_migration(engine, new_engine, chunk_size=7)
+    assert report["revision"]["target_rows"] < report["revision"]["source_rows"]
+    assert report["accountbalance"]["mismatched_chunks"]
+
+    assert catch_up(engine, new_engine, chunk_size=7, workers=2, interval=0, max_passes=5) == 0
+    report = verify_migration(engine, new_engine, chunk_size=7)
+    assert not any(table["mismatched_chunks"] for table in report.values())
+    assert all(table["source_rows"] == table["target_rows"] for table in report.values())
+
+
+def test_chunk_checksum_ignores_driver_types():
+    # As SQLite returns a row, and as Postgres returns the same row
+    sqlite_row = (7, datetime(2024, 1, 2, 3, 4, 5), 350.1, True, None, b"\x01")
+    postgres_row = (7, datetime(2024, 1, 2, 5, 4, 5, tzinfo=timezone(timedelta(hours=2))), Decimal("350.10"), 1, None,
+                    memoryview(b"\x01"))
+    assert chunk_checksum([sqlite_row]) == chunk_checksum([postgres_row])
+    assert chunk_checksum([sqlite_row]) != chunk_checksum([(7, sqlite_row[1], 350.2, True, None, b"\x01")])
+    assert chunk_checksum([(None, "a")]) != chunk_checksum([("N;", "a")])
+
+
+def test_live_migration_follows_rows_moved_to_the_archive(sample_job, tmp_path):
+    ride = {"job_id": sample_job["id"], "account_debit": f"ACC-{uuid.uuid4().hex}", "account_credit": "ACC-ARCHIVE"}
+    old = [client.post("/v1/transactions/create", json={**ride, "amount": 1.0, "timestamp": "1980-01-01T00:00:00Z"})
+           for _ in range(3)]
+    client.post("/v1/transactions/create", json={**ride, "amount": 2.0})
+    client.post("/v1/transactions/seal")
+    new_engine = create_engine(f"sqlite:///{tmp_path / 'new_database.db'}")
+    shadow_migration(engine, new_engine, chunk_size=7, workers=2)
+
+    with Session(engine) as session:
+        assert archive.archive_transactions(session, datetime(1981, 1, 1, tzinfo=timezone.utc)) >= len(old)
+        archive.restore_transaction(old[0].json()["id"], session)
+        session.commit()
+
+    assert catch_up(engine, new_engine, chunk_size=7, workers=2, interval=0, max_passes=5) == 0
+    report = verify_migration(engine, new_engine, chunk_size=7)
+    for table in ("transaction", "archivedtransaction"):
+        assert report[table]["source_rows"] == report[table]["target_rows"] and not report[table]["mismatched_chunks"]
+
+
+def test_live_migration_carries_the_outbox_and_stops_at_the_watermark(sample_transaction, tmp_path, monkeypatch):
+    import migration_utils
+
+    new_engine = create_engine(f"sqlite:///{tmp_path / 'new_database.db'}")
+    shadow_migration(engine, new_engine, chunk_size=7, workers=2)
+    with Session(engine) as session:
+        pending = session.exec(select(OutboxEvent.id).order_by(OutboxEvent.id)).all()
+        session.exec(delete(OutboxEvent).where(OutboxEvent.id == pending[0]))  # delivered
+        session.commit()
+
+    # Rows past the watermark, as if still in flight, wait for a later pass instead of being skipped for good
+    watermark = migration_utils.committed_upper_id
+    newest = client.post("/v1/jobs/create", json={"name": "In flight"}).json()
+    monkeypatch.setattr(migration_utils, "committed_upper_id",
+                        lambda old_db_engine, table: watermark(old_db_engine, table) - (table.name == "job"))
+    catch_up(engine, new_engine, chunk_size=7, workers=2, interval=0, max_passes=1)
+    with Session(new_engine) as session:
+        assert session.get(Job, newest["id"]) is None
+        assert pending[0] not in session.exec(select(OutboxEvent.id)).all()
+
+    monkeypatch.setattr(migration_utils, "committed_upper_id", watermark)
+    assert catch_up(engine, new_engine, chunk_size=7, workers=2, interval=0, max_passes=5) == 0
+    report = verify_migration(engine, new_engine, chunk_size=7)
+    assert not any(table["mismatched_chunks"] for table in report.values())
+    assert report["outboxevent"]["source_rows"] == report["outboxevent"]["target_rows"]
+
+
+def test_inject_data_is_reproducible_across_workers(tmp_path):
+    from inject_data import inject_data
+
+    dumps = []
+    for workers in (1, 2):
+        db_engine = create_engine(f"sqlite:///{tmp_path / f'generated_{workers}.db'}")
+        inject_data(jobs=20, transactions=500, revision_ratio=0.2, days=30, seed=7, batch_size=100, workers=workers,
+                    accounts=50, db_engine=db_engine)
+        with Session(db_engine) as session:
+            dumps.append([
+                session.exec(select(Transaction.id, Transaction.job_id, Transaction.account_debit,
+                                    Transaction.account_credit, Transaction.amount, Transaction.timestamp)).all(),
+                session.exec(select(Revision.original_transaction_id, Revision.corrected_transaction_id)).all(),
+            ])
+            assert len(session.exec(select(Transaction).where(revision_index.not_superseded())).all()) == 500
+            assert services.trial_balance(session)[0].balanced
+    transactions, revisions = dumps[0]
+    assert dumps[0] == dumps[1]
+    assert len(revisions) == 100 and len(transactions) == 600
+
+
+def test_benchmark_compare_flags_regressions():
+    from benchmarks.report import compare, percentiles
+
+    assert percentiles([float(ms) for ms in range(1, 101)])["p95_ms"] == pytest.approx(95.05)
+    baseline = {"1000": {"list_jobs": {"throughput": 100.0, "p95_ms": 2.0, "queries_per_call": 1.0}}}
+    within = {"1000": {"list_jobs": {"throughput": 90.0, "p95_ms": 2.4, "queries_per_call": 1.0}}}
+    assert compare(within, baseline, tolerance=0.25) == []
+    slower = {"1000": {"list_jobs": {"throughput": 50.0, "p95_ms": 2.0, "queries_per_call": 2.0}, "new": {}}}
+    assert compare(slower, baseline, tolerance=0.25) == [
+        "1000.list_jobs.throughput: 50.00 (baseline 100.00)",
+        "1000.list_jobs.queries_per_call: 2.00 (baseline 1.00)",
+    ]
+
+
+def test_async_database_url_swaps_in_the_async_driver():
+    assert config.async_database_url("sqlite:///database.db") == "sqlite+aiosqlite:///database.db"
+    assert config.async_database_url("postgresql://user:pw@host/ledger") == "postgresql+asyncpg://user:pw@host/ledger"
+    assert config.async_database_url("postgresql+psycopg2://host/ledger") == "postgresql+asyncpg://host/ledger"
+    assert config.async_database_url("sqlite+aiosqlite:////tmp/t.db") == "sqlite+aiosqlite:////tmp/t.db"
+
+
+def test_worker_environment_splits_pools_and_keeps_overrides():
+    assert serve.worker_environment(1, {}) == {}
+    assert serve.worker_environment(4, {"OUTBOX_DISPATCHER": "true"}) == {"DB_POOL_SIZE": "13", "DB_MAX_OVERFLOW": "25"}
+
+
+def test_metrics_endpoint_reports_routes_and_queries(sample_job):
+    client.get("/v1/jobs/list")
+    body = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/v1/jobs/list",status="200"}' in body
+    assert 'http_requests_in_flight{method="GET"} 1' in body  # the scrape itself
+    queries = metrics.DB_QUERIES.value(route="/v1/jobs/list")
+    assert queries and queries >= 1
+    assert "db_pool_checkout_wait_seconds_bucket" in body
+    assert "outbox_depth " in body
+
+
+def test_slow_request_log_captures_statements(caplog):
+    slow_app = FastAPI()
+    slow_app.add_middleware(metrics.MetricsMiddleware, slow_request_ms=0.001)
+
+    @slow_app.get("/count")
+    def count_jobs():
+        with Session(engine) as session:
+            return session.exec(select(func.count()).select_from(Job)).one()
+
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        TestClient(slow_app).get("/count")
+    assert "Slow request GET /count (/count) -> 200" in caplog.text
+    assert "SELECT count(*)" in caplog.text
+
+
+def test_limiter_queues_then_rejects():
+    async def scenario():
+        limiter = admission.Limiter(concurrency=1, queue_size=1, queue_timeout=0.05)
+        assert await limiter.acquire() is None
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert await limiter.acquire() == admission.QUEUE_FULL
+        assert await queued == admission.QUEUE_TIMEOUT
+
+        handed_over = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        assert await handed_over is None
+        limiter.release()
+        return limiter.active
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_admission_middleware_rejects_over_capacity_with_retry_after():
+    limited_app = FastAPI()
+    limited_app.add_middleware(admission.AdmissionMiddleware, limiters={admission.WRITE: admission.Limiter(0, 0, 2.5)})
+
+    @limited_app.post("/v1/things")
+    def create_thing():
+        return {}
+
+    @limited_app.get("/v1/things")
+    def list_things():
+        return []
+
+    limited_client = TestClient(limited_app)
+    rejected = limited_client.post("/v1/things")
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "3"
+    assert limited_client.get("/v1/things").status_code == 200
+    assert admission.route_class("POST", "/v1/transactions/seal") == admission.EXPENSIVE
+
+
+def test_seal_runs_off_the_event_loop(monkeypatch):
+    import threading
+
+    seal_threads = []
+    monkeypatch.setattr(services, "seal_transactions", lambda session: seal_threads.append(threading.get_ident()))
+
+    async def seal():
+        await async_services.seal_transactions(None)
+        return threading.get_ident()
+
+    assert asyncio.run(seal()) not in seal_threads and len(seal_threads) == 1
+
+
+def test_concurrent_seals_share_one_run(sample_transaction):
+    async def seal_together():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            return await asyncio.gather(*(async_services.seal_transactions(session) for _ in range(3)))
+
+    manifests = asyncio.run(seal_together())
+    assert len({manifest.id for manifest in manifests}) == 1
+
+
+def test_list_pages_are_uncached_by_default(sample_job):
+    assert config.RESPONSE_CACHE is False
+    response = client.get("/v1/jobs/list")
+    assert response.status_code == 200 and "ETag" not in response.headers
+
+
+def test_list_pages_are_cached_until_a_write(sample_job, monkeypatch):
+    monkeypatch.setattr(main, "RESPONSE_CACHE", True)
+    url = "/v1/jobs/list?limit=1000"
+    first = client.get(url)
+    etag = first.headers["ETag"]
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    sqlalchemy.event.listen(async_engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        assert client.get(url).content == first.content
+    finally:
+        sqlalchemy.event.remove(async_engine.sync_engine, "before_cursor_execute", listener)
+    assert statements == []
+
+    # A committed write to the table moves its generation, so the old ETag no longer matches
+    job = client.post("/v1/jobs/create", json={"name": "Cached"}).json()
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert job["id"] in [row["id"] for row in changed.json()]
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = response_cache.ResponseCache(max_entries=2, max_bytes=10)
+    cache.put("a", response_cache.CachedResponse(b"1234", {}))
+    cache.put("b", response_cache.CachedResponse(b"1234", {}))
+    cache.get("a")
+    cache.put("c", response_cache.CachedResponse(b"1234", {}))
+    assert cache.get("b") is None and cache.get("a") and cache.get("c")
+    cache.put("d", response_cache.CachedResponse(b"123456789", {}))
+    assert len(cache) == 1 and cache.size == 9
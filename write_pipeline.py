@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Callable
+
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from config import GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WritePipeline:
+    # Single writer task that commits concurrent writes together, so SQLite pays one
+    # fsync per batch instead of one per request
+    def __init__(self, engine, window_ms: float = GROUP_COMMIT_WINDOW_MS, max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    async def submit(self, add: Callable, *args):
+        if self._task is None:
+            raise RuntimeError("Write pipeline is not running.")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((add, args, future))
+        return await future
+
+    async def run(self):
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+
+            # Give concurrent writers a few milliseconds to join this commit
+            batch = [item]
+            await asyncio.sleep(self.window)
+            stopping = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self.commit_batch(batch)
+            if stopping:
+                return
+
+    async def commit_batch(self, batch):
+        outcomes = []
+
+        def apply(sync_session):
+            # pysqlite and aiosqlite emit no BEGIN before a SAVEPOINT, so each RELEASE would commit its write on
+            # its own. An explicit outer transaction keeps the whole batch to one COMMIT; IMMEDIATE takes the
+            # write lock up front rather than failing to upgrade a read lock halfway through.
+            if sync_session.get_bind().dialect.name == "sqlite":
+                sync_session.execute(text("BEGIN IMMEDIATE"))
+            # A savepoint per write, so one rejected write does not sink the batch
+            for add, args, future in batch:
+                try:
+                    with sync_session.begin_nested():
+                        outcomes.append((future, add(*args, sync_session), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+
+        try:
+            async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                await session.run_sync(apply)
+                await session.commit()
+        except Exception as e:
+            # Nothing in the batch was committed, so every write fails with it
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Writes already queued are committed before the task exits
+        task, self._task = self._task, None
+        if task:
+            await self._queue.put(_STOP)
+            await task